@@ -1,10 +1,20 @@
+import os
 import argparse
 import sys
 import json
 import tempfile
 
 from .model import Job, Graph
-from .pbs_utils import qsub, run_bash
+from .pbs_utils import run_bash, run_command
+from . import snapshot as snapshot_
+from .backends import BACKENDS, get_backend
+from .submitter import submit_graph
+from .simulate import simulate, ORDERS
+from .metrics import REGISTRY as metrics, FORMATS
+from .records import default_record_path, read_record
+from .cancel import cancel_graph
+from .watch import Watcher
+from . import history as history_
 
 
 def argument_parser():
@@ -18,6 +28,15 @@ def argument_parser():
             help="use to specify the type of json config file,"
             " 'graph' for jobs, 'job' for single job")
 
+    parser.add_argument("--metrics",
+            default=None,
+            help="write metrics of building, rendering and submission to this file")
+    parser.add_argument("--metrics-format",
+            choices=FORMATS,
+            default="jsonl",
+            help="metrics file format, 'jsonl' append JSON lines,"
+            " 'prom' write Prometheus textfile [jsonl]")
+
     subparsers = parser.add_subparsers(
             title="sub-commands",
             help="sub-command help")
@@ -27,12 +46,30 @@ def argument_parser():
             help="convert json config file to a control shell script.")
     convert_parser.add_argument("json",
             type=argparse.FileType(mode='r'),
-            help="config json file")
+            help="config json file, or graph snapshot file (see 'snapshot')")
     convert_parser.add_argument("target",
             type=argparse.FileType(mode='w'),
             default=sys.stdout,
             nargs='?',
             help="target control script [stdout]")
+    convert_parser.add_argument("--job-dir", "-d",
+            default=None,
+            help="write job scripts to files in this directory,"
+            " instead of embedding them in the control script")
+    convert_parser.add_argument("--record", "-r",
+            default=None,
+            help="let the control script record submitted job ids to this file")
+    convert_parser.add_argument("--watch", "-w",
+            action="store_true",
+            help="keep converting when the config file or included files changed,"
+            " only edited jobs are built again")
+    convert_parser.add_argument("--interval",
+            type=float,
+            default=1.0,
+            help="seconds between file polls in watch mode [1]")
+    add_history_arguments(convert_parser)
+    add_processes_argument(convert_parser)
+    add_scheduler_argument(convert_parser)
     convert_parser.set_defaults(func=convert)
 
     # "submit" sub command
@@ -40,46 +77,300 @@ def argument_parser():
             help="submit jobs which descripted in json config file.")
     submit_parser.add_argument("json",
             type=argparse.FileType(mode='r'),
-            help="config json file")
+            help="config json file, or graph snapshot file (see 'snapshot')")
+    submit_parser.add_argument("--max-inflight", "-m",
+            type=int,
+            default=None,
+            help="keep at most this number of jobs queued or running,"
+            " submit the rest when earlier jobs finished, implies --direct")
+    submit_parser.add_argument("--direct",
+            action="store_true",
+            help="submit jobs one by one from python instead of running the control script,"
+            " submit commands are retried and their metrics recorded")
+    submit_parser.add_argument("--poll-interval",
+            type=float,
+            default=30,
+            help="seconds between job status polls in throttled mode [30]")
+    submit_parser.add_argument("--record", "-r",
+            default=None,
+            help="record submitted job ids to this file [<json>.ids]")
+    add_history_arguments(submit_parser)
+    add_processes_argument(submit_parser)
+    add_scheduler_argument(submit_parser)
     submit_parser.set_defaults(func=submit)
+
+    # "snapshot" sub command
+    snapshot_parser = subparsers.add_parser("snapshot",
+            help="save the built graph to a binary snapshot file.")
+    snapshot_parser.add_argument("json",
+            type=argparse.FileType(mode='r'),
+            help="config json file")
+    snapshot_parser.add_argument("target",
+            help="target snapshot file")
+    add_processes_argument(snapshot_parser)
+    add_scheduler_argument(snapshot_parser)
+    snapshot_parser.set_defaults(func=snapshot)
+
+    # "cancel" sub command
+    cancel_parser = subparsers.add_parser("cancel",
+            help="cancel the submitted jobs of a graph.")
+    cancel_parser.add_argument("json",
+            type=argparse.FileType(mode='r'),
+            help="config json file, or graph snapshot file (see 'snapshot')")
+    cancel_parser.add_argument("--from", "-f",
+            dest="from_job",
+            default=None,
+            help="only cancel this job(id or name) and the jobs depend on it")
+    cancel_parser.add_argument("--record", "-r",
+            default=None,
+            help="the record file of submitted job ids [<json>.ids]")
+    cancel_parser.add_argument("--batch", "-b",
+            type=int,
+            default=500,
+            help="max number of job ids per cancel command [500]")
+    cancel_parser.add_argument("--parallel",
+            type=int,
+            default=4,
+            help="number of cancel commands run in parallel [4]")
+    add_scheduler_argument(cancel_parser)
+    cancel_parser.set_defaults(func=cancel)
+
+    # "simulate" sub command
+    simulate_parser = subparsers.add_parser("simulate",
+            help="simulate running jobs on a cluster, estimate makespan and queue load.")
+    simulate_parser.add_argument("json",
+            type=argparse.FileType(mode='r'),
+            help="config json file, or graph snapshot file (see 'snapshot')")
+    simulate_parser.add_argument("--cores", "-c",
+            type=int,
+            required=True,
+            help="number of cores of the cluster")
+    simulate_parser.add_argument("--default-walltime", "-w",
+            default="01:00:00",
+            help="walltime of jobs which not specify it [01:00:00]")
+    simulate_parser.add_argument("--order", "-o",
+            choices=ORDERS,
+            default="fifo",
+            help="priority of ready jobs [fifo]")
+    add_history_arguments(simulate_parser)
+    add_processes_argument(simulate_parser)
+    simulate_parser.set_defaults(func=simulate_)
+
+    # "collect" sub command
+    collect_parser = subparsers.add_parser("collect",
+            help="record runtime and peak memory of finished jobs to the history database.")
+    collect_parser.add_argument("json",
+            type=argparse.FileType(mode='r'),
+            help="config json file, or graph snapshot file (see 'snapshot')")
+    collect_parser.add_argument("--record", "-r",
+            default=None,
+            help="the record file of submitted job ids [<json>.ids]")
+    collect_parser.add_argument("--history",
+            default=history_.DEFAULT_PATH,
+            help="the runtime history database [{}]".format(history_.DEFAULT_PATH))
+    add_scheduler_argument(collect_parser)
+    collect_parser.set_defaults(func=collect)
     return parser
 
 
+def add_processes_argument(parser):
+    parser.add_argument("--processes", "-p",
+            type=int,
+            default=None,
+            help="build jobs in parallel with this number of processes")
+
+
+def add_scheduler_argument(parser):
+    parser.add_argument("--scheduler", "-s",
+            choices=sorted(BACKENDS),
+            default=None,
+            help="scheduler backend, override the 'scheduler' field of config file [pbs]")
+
+
+def add_history_arguments(parser):
+    parser.add_argument("--history",
+            nargs="?",
+            const=history_.DEFAULT_PATH,
+            default=None,
+            help="fill in walltime and mem of jobs from the runtime history database"
+            " (see 'collect') [{}]".format(history_.DEFAULT_PATH))
+    parser.add_argument("--tighten",
+            action="store_true",
+            help="with --history, also lower the requested walltime and mem to the estimates")
+
+
+def use_history(args, graph):
+    """ Set resources of jobs in graph from the runtime history, if --history given. """
+    if not args.history:
+        return
+    history = history_.History(args.history)
+    try:
+        history_.apply_history(graph, history, tighten=args.tighten)
+    finally:
+        history.close()
+
+
+def load_graph(args, processes=None):
+    """
+    Build the Graph from the config json file,
+    or restore it from a snapshot file without parsing json.
+    """
+    backend = getattr(args, 'scheduler', None)
+    if args.json is not sys.stdin and snapshot_.is_snapshot(args.json.name):
+        args.json.close()
+        snap = snapshot_.load(args.json.name)
+        try:
+            return snap.to_graph(backend=backend)
+        finally:
+            snap.close()
+    with args.json as f:
+        js_dict = json.load(f)
+    return Graph(js_dict, processes=processes, backend=backend, base_dir=json_dir(args))
+
+
+def json_dir(args):
+    """ The directory of config json file, included paths are relative to it. """
+    return os.path.dirname(os.path.abspath(args.json.name))
+
+
+def record_path(args):
+    """ The record file of submitted job ids, None if config is read from stdin. """
+    if args.record:
+        return args.record
+    if args.json is sys.stdin or args.json.name.startswith("<"):
+        return None
+    return default_record_path(args.json.name)
+
+
 def convert(args):
     """ Function for process 'convert' sub command. """
-    with args.json as f:
-        js_str = f.read()
-    js_dict = json.loads(js_str)
+    if args.watch:
+        return watch(args)
+    if args.type == 'job':
+        with args.json as f:
+            js_dict = json.load(f)
+        with args.target as f:
+            f.write(Job(js_dict).render(args.scheduler))
+        return
+    g = load_graph(args, processes=args.processes)
+    use_history(args, g)
     with args.target as f:
-        if args.type == 'job':
-            job = Job(js_dict)
-            f.write(job.pbs_script)
-        else:
-            g = Graph(js_dict)
-            f.write(g.control_script)
+        f.write(g.render_control_script(job_dir=args.job_dir, record=args.record))
+
+
+def watch(args):
+    """ 'convert --watch', convert again on changes until interrupted. """
+    if args.type == 'job' or args.json is sys.stdin or args.target is sys.stdout:
+        sys.exit("--watch requires a graph config file and a target file.")
+    args.json.close()
+    args.target.close()
+    history = history_.History(args.history) if args.history else None
+    watcher = Watcher(args.json.name, args.target.name,
+            job_dir=args.job_dir,
+            record=args.record,
+            interval=args.interval,
+            processes=args.processes,
+            backend=args.scheduler,
+            history=history,
+            tighten=args.tighten)
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if history is not None:
+            history.close()
 
 
 def submit(args):
     """ Function for process 'submit' sub command."""
-    with args.json as f:
-        js_str = f.read()
-    js_dict = json.loads(js_str)
     if args.type == 'job':
+        with args.json as f:
+            js_dict = json.load(f)
         job = Job(js_dict)
-        qsub(job.script_str)
+        backend = get_backend(args.scheduler)
+        try:
+            output = run_command(backend.submit_argv(), input=job.render(backend))
+        except OSError as e:
+            sys.exit("Failed to submit job '{}': {}".format(job.name, e))
+        id_ = backend.parse_submit_output(output or "")
+        if not id_:
+            sys.exit("Failed to submit job '{}'.".format(job.name))
+        print(id_)
     else:
-        g = Graph(js_dict)
+        g = load_graph(args, processes=args.processes)
+        use_history(args, g)
+        record = record_path(args)
+        if args.direct or args.max_inflight:
+            submit_graph(g, max_inflight=args.max_inflight, poll_interval=args.poll_interval,
+                         record=record)
+            return
         with tempfile.NamedTemporaryFile(mode='w') as f:
-            f.write(g.control_script)
+            f.write(g.render_control_script(record=record))
             f.flush()
             run_bash(f.name)
 
 
+def snapshot(args):
+    """ Function for process 'snapshot' sub command. """
+    with args.json as f:
+        js_str = f.read()
+    js_dict = json.loads(js_str)
+    g = Graph(js_dict, processes=args.processes, backend=args.scheduler,
+              base_dir=json_dir(args))
+    snapshot_.dump(g, args.target)
+
+
+def cancel(args):
+    """ Function for process 'cancel' sub command. """
+    g = load_graph(args)
+    record = record_path(args)
+    if record is None:
+        sys.exit("The record file of submitted job ids is required, use --record.")
+    cancelled, failed = cancel_graph(g, read_record(record),
+            from_job=args.from_job,
+            batch=args.batch,
+            parallel=args.parallel)
+    print("{} jobs cancelled.".format(len(cancelled)))
+    for ids, error in failed:
+        sys.stderr.write("Failed to cancel {} jobs: {}\n".format(len(ids), error))
+    if failed:
+        sys.exit(1)
+
+
+def simulate_(args):
+    """ Function for process 'simulate' sub command. """
+    g = load_graph(args, processes=args.processes)
+    use_history(args, g)
+    res = simulate(g, args.cores,
+            default_walltime=args.default_walltime,
+            order=args.order)
+    print(res.report())
+
+
+def collect(args):
+    """ Function for process 'collect' sub command. """
+    g = load_graph(args)
+    record = record_path(args)
+    if record is None:
+        sys.exit("The record file of submitted job ids is required, use --record.")
+    history = history_.History(args.history)
+    try:
+        n = history.collect(g, read_record(record))
+    finally:
+        history.close()
+    print("{} finished jobs recorded.".format(n))
+
+
 def main():
     parser = argument_parser()
     args = parser.parse_args()
     if hasattr(args, 'func'):
-        args.func(args)
+        try:
+            args.func(args)
+        finally:
+            if args.metrics:
+                metrics.write(args.metrics, fmt=args.metrics_format)
     else:
         parser.print_help()
 
@@ -0,0 +1,457 @@
+import re
+from collections import namedtuple
+
+from .exceptions import ConfFileSyntaxError, InvalidResources, CommandError
+from .pbs_utils import run_command
+from .resources import parse_size, parse_walltime
+
+"""
+backends
+~~~~~~~~
+Scheduler backends, render job script headers,
+construct submit/status/cancel command lines and parse their output.
+
+Supported schedulers:
+
+    | pbs:    PBS/Torque (default)
+    | pbspro: PBS Professional
+    | slurm:  Slurm
+
+Get a backend by name:
+>>> backend = get_backend("slurm")
+>>> print(backend.render(job))
+>>> backend.submit_argv(name="job2", depends=[("afterok", "123")], script="job2.sh")
+['sbatch', '--parsable', '--job-name=job2', '--dependency=afterok:123', 'job2.sh']
+
+Job states returned by `parse_status` and `poll`:
+
+    | queued:  waiting in the queue (include held jobs)
+    | running: running or exiting
+    | done:    completed, or not found in the queue any more
+
+Resources usage of finished jobs returned by `parse_accounting`
+are `Usage(ok, runtime, mem)` tuples: exited normally or not,
+seconds of walltime used and bytes of peak memory (None if unknown).
+
+"""
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+
+Usage = namedtuple('Usage', ['ok', 'runtime', 'mem'])
+
+
+def _parse_or_none(parse, value):
+    if not value:
+        return None
+    try:
+        return parse(value)
+    except (InvalidResources, ValueError):
+        return None
+
+
+class Backend(object):
+    """
+    Base class of scheduler backends.
+
+    Subclasses define the command names and implement:
+        header, submit_options, depend_option, parse_submit_output,
+        status_argv, parse_status, accounting_argv, parse_accounting
+    """
+    name = None
+    directive = None
+    submit_command = []
+    cancel_command = []
+    unknown_job_errors = () # error messages of querying jobs which left the scheduler
+
+    def header(self, job, with_name=True):
+        """ Return the list of directive lines of the job script. """
+        raise NotImplementedError
+
+    def render(self, job, with_name=True):
+        """
+        Convert job to script string.
+
+        :with_name: include the job name in the header,
+                    jobs with the same body can share one script
+                    when the name is passed by submit options. [True]
+
+        """
+        lines = self.header(job, with_name=with_name)
+        lines.extend(self.preamble(job))
+        lines.extend(job.commands)
+        return "\n".join(lines)
+
+    def preamble(self, job):
+        """ Commands insert before job commands. """
+        return []
+
+    def depend_option(self, depends):
+        """
+        Return the submit options for dependences.
+
+        :depends: list of (dependent type, job id) pairs.
+
+        """
+        raise NotImplementedError
+
+    def submit_options(self, name=None, depends=()):
+        """ Return the submit options(without command) for job name and dependences. """
+        raise NotImplementedError
+
+    def submit_argv(self, name=None, depends=(), script=None):
+        """
+        Return the argv for submit a job,
+        the script is read from stdin if script is None.
+        """
+        argv = list(self.submit_command) + self.submit_options(name, depends)
+        if script is not None:
+            argv.append(script)
+        return argv
+
+    def parse_submit_output(self, output):
+        """ Fetch the job id from submit command output. """
+        return output.strip()
+
+    def status_argv(self, ids):
+        """ Return the argv for query the jobs status. """
+        raise NotImplementedError
+
+    def parse_status(self, output):
+        """ Parse status command output, return a dict mapping job id to state. """
+        raise NotImplementedError
+
+    def query(self, argv, run=run_command):
+        """
+        Run a status or accounting command, return it's stdout.
+        The command fails when some ids already left the scheduler,
+        that's ignored if all the error lines match `unknown_job_errors`,
+        else the CommandError is raised.
+        """
+        try:
+            return run(argv)
+        except CommandError as e:
+            lines = [line for line in e.stderr.splitlines() if line.strip()]
+            if lines and all(any(p in line for p in self.unknown_job_errors) for line in lines):
+                return e.output or ""
+            raise
+
+    def poll(self, ids, run=run_command):
+        """
+        Query jobs status, return a dict mapping job id to state,
+        jobs not found in the output are seen as done.
+        Ids are matched exactly, or by the part before the first '.',
+        as qstat truncates long ids like "123.server.domain".
+        raise CommandError if the status command fails.
+        """
+        ids = list(ids)
+        if not ids:
+            return {}
+        found = self.parse_status(self.query(self.status_argv(ids), run))
+        short = dict((id_.split(".")[0], state) for id_, state in found.items())
+        states = {}
+        for id_ in ids:
+            if id_ in found:
+                states[id_] = found[id_]
+            else:
+                states[id_] = short.get(id_.split(".")[0], DONE)
+        return states
+
+    def cancel_argv(self, ids):
+        """ Return the argv for cancel jobs. """
+        return list(self.cancel_command) + list(ids)
+
+    def accounting_argv(self, ids):
+        """ Return the argv for query the resources usage of finished jobs. """
+        raise NotImplementedError
+
+    def parse_accounting(self, output):
+        """
+        Parse accounting command output,
+        return a dict mapping job id to `Usage` of finished jobs.
+        """
+        raise NotImplementedError
+
+
+def _parse_qstat_table(output, state_map, id_col=0, state_col=4):
+    """ Parse the default table output of qstat. """
+    states = {}
+    in_table = False
+    for line in output.splitlines():
+        if line.startswith("---"):
+            in_table = True
+            continue
+        fields = line.split()
+        if not in_table or len(fields) <= state_col:
+            continue
+        states[fields[id_col]] = state_map.get(fields[state_col], QUEUED)
+    return states
+
+
+def _parse_qstat_full(output):
+    """ Parse the output of 'qstat -f', return a dict mapping job id to attributes. """
+    jobs = {}
+    attrs = None
+    for line in output.splitlines():
+        if line.startswith("Job Id:"):
+            attrs = jobs[line.split(":", 1)[1].strip()] = {}
+        elif attrs is not None and " = " in line:
+            k, v = line.split(" = ", 1)
+            attrs[k.strip().lower()] = v.strip()
+    return jobs
+
+
+class PBSBackend(Backend):
+    """ PBS/Torque backend. """
+    name = 'pbs'
+    directive = '#PBS'
+    submit_command = ['qsub']
+    cancel_command = ['qdel']
+    unknown_job_errors = ('Unknown Job Id',)
+    state_map = {
+        'Q': QUEUED, 'H': QUEUED, 'W': QUEUED, 'T': QUEUED, 'S': QUEUED,
+        'R': RUNNING, 'E': RUNNING,
+        'C': DONE,
+    }
+
+    def header(self, job, with_name=True):
+        lines = []
+        if with_name:
+            lines.append("#PBS -N {}".format(job.name))
+        lines.append("#PBS -d {}".format(job.dir))
+        if job.queue: # not set, the scheduler's default queue
+            lines.append("#PBS -q {}".format(job.queue))
+        if getattr(job, 'array', None):
+            lines.append("#PBS -t {}".format(job.array))
+
+        resources = job.resources.copy() # if not copy, will change the default resources
+        if ('nodes' in resources) and ('ppn' in resources):
+            nodes, ppn = resources.pop('nodes'), resources.pop('ppn')
+            lines.append("#PBS -l nodes={}:ppn={}".format(nodes, ppn))
+        elif ('ppn' in resources) and ('nodes' not in resources):
+            raise ConfFileSyntaxError("Resources can't only contain ppn without nodes")
+        for k, v in resources.items():
+            lines.append("#PBS -l {}={}".format(k, v))
+        return lines
+
+    def depend_option(self, depends):
+        depends = [type_ + ":" + str(id_) for type_, id_ in depends]
+        return ["-W", "depend=" + ",".join(depends)]
+
+    def submit_options(self, name=None, depends=()):
+        options = []
+        if name:
+            options += ["-N", name]
+        if depends:
+            options += self.depend_option(depends)
+        return options
+
+    def status_argv(self, ids):
+        return ["qstat"] + list(ids)
+
+    def parse_status(self, output):
+        return _parse_qstat_table(output, self.state_map)
+
+    def accounting_argv(self, ids):
+        # Torque keeps completed jobs in qstat for 'keep_completed' seconds
+        return ["qstat", "-f"] + list(ids)
+
+    def parse_accounting(self, output, state_map=None):
+        state_map = state_map or self.state_map
+        usages = {}
+        for id_, attrs in _parse_qstat_full(output).items():
+            if state_map.get(attrs.get('job_state')) != DONE:
+                continue
+            usages[id_] = Usage(
+                    ok=attrs.get('exit_status') == '0',
+                    runtime=_parse_or_none(parse_walltime, attrs.get('resources_used.walltime')),
+                    mem=_parse_or_none(parse_size, attrs.get('resources_used.mem')))
+        return usages
+
+
+class PBSProBackend(PBSBackend):
+    """
+    PBS Professional backend.
+    It has no '-d' option, change to the working directory in the script.
+    """
+    name = 'pbspro'
+    unknown_job_errors = ('Unknown Job Id', 'Job has finished')
+
+    def header(self, job, with_name=True):
+        lines = []
+        if with_name:
+            lines.append("#PBS -N {}".format(job.name))
+        if job.queue:
+            lines.append("#PBS -q {}".format(job.queue))
+        if getattr(job, 'array', None):
+            lines.append("#PBS -J {}".format(job.array))
+
+        resources = job.resources.copy()
+        if ('nodes' in resources) and ('ppn' in resources):
+            nodes, ppn = resources.pop('nodes'), resources.pop('ppn')
+            lines.append("#PBS -l select={}:ncpus={}".format(nodes, ppn))
+        elif ('ppn' in resources) and ('nodes' not in resources):
+            raise ConfFileSyntaxError("Resources can't only contain ppn without nodes")
+        for k, v in resources.items():
+            lines.append("#PBS -l {}={}".format(k, v))
+        return lines
+
+    def preamble(self, job):
+        return ["cd {}".format(job.dir)]
+
+    def depend_option(self, depends):
+        # PBS Pro has no 'afterokarray', 'afterok' works on array jobs.
+        depends = [("afterok" if t == "afterokarray" else t, id_) for t, id_ in depends]
+        return super(PBSProBackend, self).depend_option(depends)
+
+    def status_argv(self, ids):
+        return ["qstat", "-x"] + list(ids)
+
+    def parse_status(self, output):
+        state_map = dict(self.state_map)
+        state_map.update({'F': DONE, 'X': DONE, 'B': RUNNING})
+        return _parse_qstat_table(output, state_map)
+
+    def accounting_argv(self, ids):
+        return ["qstat", "-x", "-f"] + list(ids)
+
+    def parse_accounting(self, output):
+        state_map = dict(self.state_map)
+        state_map.update({'F': DONE, 'X': DONE})
+        return super(PBSProBackend, self).parse_accounting(output, state_map)
+
+
+class SlurmBackend(Backend):
+    """ Slurm backend. """
+    name = 'slurm'
+    directive = '#SBATCH'
+    submit_command = ['sbatch', '--parsable']
+    cancel_command = ['scancel']
+    unknown_job_errors = ('Invalid job id',)
+    resource_options = {
+        'nodes': 'nodes',
+        'ppn': 'ntasks-per-node',
+        'walltime': 'time',
+        'mem': 'mem',
+    }
+    depend_types = {
+        'afterok': 'afterok',
+        'afterany': 'afterany',
+        'afternotok': 'afternotok',
+        'afterokarray': 'afterok',
+    }
+    state_map = {
+        'PD': QUEUED, 'S': QUEUED, 'RQ': QUEUED, 'RS': QUEUED,
+        'R': RUNNING, 'CG': RUNNING, 'SO': RUNNING,
+        'CD': DONE, 'F': DONE, 'CA': DONE, 'TO': DONE, 'NF': DONE,
+        'OOM': DONE, 'PR': DONE, 'BF': DONE, 'DL': DONE,
+    }
+    unfinished_states = ('PENDING', 'RUNNING', 'REQUEUED', 'RESIZING', 'SUSPENDED', 'COMPLETING')
+
+    @staticmethod
+    def convert_mem(mem):
+        """ convert PBS memory size like '4gb' to Slurm format '4G'. """
+        m = re.match(r"^(\d+)([kmgt])b?$", str(mem).strip().lower())
+        if m:
+            return m.group(1) + m.group(2).upper()
+        return mem
+
+    def header(self, job, with_name=True):
+        lines = ["#!/bin/bash"] # sbatch requires the interpreter line
+        if with_name:
+            lines.append("#SBATCH --job-name={}".format(job.name))
+        lines.append("#SBATCH --chdir={}".format(job.dir))
+        if job.queue: # not set, the cluster's default partition
+            lines.append("#SBATCH --partition={}".format(job.queue))
+        if getattr(job, 'array', None):
+            lines.append("#SBATCH --array={}".format(job.array))
+        if ('ppn' in job.resources) and ('nodes' not in job.resources):
+            raise ConfFileSyntaxError("Resources can't only contain ppn without nodes")
+        for k, v in job.resources.items():
+            if k == 'mem':
+                v = self.convert_mem(v)
+            lines.append("#SBATCH --{}={}".format(self.resource_options.get(k, k), v))
+        return lines
+
+    def depend_option(self, depends):
+        type2ids = {}
+        types = []
+        for type_, id_ in depends:
+            type_ = self.depend_types.get(type_, type_)
+            if type_ not in type2ids:
+                type2ids[type_] = []
+                types.append(type_)
+            type2ids[type_].append(str(id_))
+        depends = [t + ":" + ":".join(type2ids[t]) for t in types]
+        return ["--dependency=" + ",".join(depends)]
+
+    def submit_options(self, name=None, depends=()):
+        options = []
+        if name:
+            options.append("--job-name=" + name)
+        if depends:
+            options += self.depend_option(depends)
+        return options
+
+    def parse_submit_output(self, output):
+        return output.strip().split(";")[0] # --parsable output: "jobid[;cluster]"
+
+    def status_argv(self, ids):
+        return ["squeue", "-h", "-o", "%i %t", "-j", ",".join(ids)]
+
+    def parse_status(self, output):
+        states = {}
+        for line in output.splitlines():
+            fields = line.split()
+            if len(fields) == 2:
+                # unknown states are seen as queued, not to flood the queue
+                states[fields[0]] = self.state_map.get(fields[1], QUEUED)
+        return states
+
+    def accounting_argv(self, ids):
+        return ["sacct", "-n", "-P", "-o", "JobID,State,ElapsedRaw,MaxRSS", "-j", ",".join(ids)]
+
+    def parse_accounting(self, output):
+        jobs = {}  # job id -> [state, elapsed seconds]
+        mems = {}  # job id -> peak memory of its steps
+        for line in output.splitlines():
+            fields = line.split("|")
+            if len(fields) != 4:
+                continue
+            step, state, elapsed, maxrss = fields
+            id_ = step.split(".")[0]
+            if step == id_:
+                jobs[id_] = [state.split(" ")[0], elapsed] # like "CANCELLED by 1000"
+            mem = _parse_or_none(parse_size, maxrss)
+            if mem is not None:
+                mems[id_] = max(mems.get(id_, 0), mem)
+        usages = {}
+        for id_, (state, elapsed) in jobs.items():
+            if state in self.unfinished_states:
+                continue
+            usages[id_] = Usage(
+                    ok=state == 'COMPLETED',
+                    runtime=_parse_or_none(float, elapsed),
+                    mem=mems.get(id_))
+        return usages
+
+
+BACKENDS = {
+    'pbs': PBSBackend,
+    'torque': PBSBackend,
+    'pbspro': PBSProBackend,
+    'slurm': SlurmBackend,
+}
+DEFAULT_BACKEND = 'pbs'
+
+
+def get_backend(backend=None):
+    """ Get a backend instance by name, backend instances are returned as it is. """
+    if isinstance(backend, Backend):
+        return backend
+    name = (backend or DEFAULT_BACKEND).lower()
+    if name not in BACKENDS:
+        raise ConfFileSyntaxError("Unknown scheduler '{}', supported: {}".format(
+            backend, ", ".join(sorted(BACKENDS))))
+    return BACKENDS[name]()
@@ -0,0 +1,96 @@
+from multiprocessing.pool import ThreadPool
+
+from .model import Job
+from .pbs_utils import run_command
+from .exceptions import ConfFileSyntaxError
+from .metrics import REGISTRY as metrics
+
+"""
+cancel
+~~~~~~
+Cancel the submitted jobs of a graph, or a sub tree of it,
+with the recorded scheduler job ids (see `j2pbs.records`).
+Job ids are cancelled in batches, many ids per command, several commands in parallel.
+
+>>> name2id = read_record("pipeline.json.ids")
+>>> cancelled, failed = cancel_graph(graph, name2id, from_job="qc.0")
+
+"""
+
+
+def find_job(graph, key):
+    """ Find job in graph by it's id or name, key is a string from command line. """
+    for job in graph.jobs:
+        if str(job.id) == str(key):
+            return job
+    for job in graph.jobs:
+        if job.name == key:
+            return job
+    raise ConfFileSyntaxError("Job '{}' not found in graph.".format(key))
+
+
+def affected_jobs(graph, from_job=None):
+    """
+    Jobs to be cancelled in reversed topological order(dependents first),
+    all jobs if from_job is None, else from_job and jobs depend on it.
+    """
+    order = graph.topological_order()
+    if from_job is not None:
+        subtree = graph.descendants(from_job)
+        subtree.add(from_job)
+        order = [job for job in order if job in subtree]
+    order.reverse()
+    return order
+
+
+def cancel_graph(graph, name2id, from_job=None, batch=500, parallel=4, run=run_command):
+    """
+    Cancel the submitted jobs of graph.
+
+    :graph: the Graph submitted.
+    :name2id: dict mapping job name to scheduler job id.
+    :from_job: only cancel this job (a Job, or it's id or name)
+               and the jobs depend on it. [None]
+    :batch: max number of ids per cancel command. [500]
+    :parallel: number of cancel commands run at the same time. [4]
+    :run: function for run a command: run(argv) -> stdout,
+          raise OSError(like CommandError) if the command failed.
+
+    return (cancelled, failed), the list of cancelled scheduler job ids,
+    and the list of (job ids, error message) of the failed cancel commands.
+    Ids already left the scheduler are counted as cancelled.
+
+    """
+    if (from_job is not None) and not isinstance(from_job, Job):
+        from_job = find_job(graph, from_job)
+    ids = [name2id[job.name] for job in affected_jobs(graph, from_job) if job.name in name2id]
+    batches = [ids[i:i+batch] for i in range(0, len(ids), batch)]
+    backend = graph.backend
+
+    def cancel_batch(ids):
+        try:
+            backend.query(backend.cancel_argv(ids), run)
+        except OSError as e:
+            return str(e)
+        return None
+
+    if len(batches) > 1 and parallel > 1:
+        pool = ThreadPool(min(parallel, len(batches)))
+        try:
+            errors = pool.map(cancel_batch, batches)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        errors = [cancel_batch(b) for b in batches]
+    cancelled = []
+    failed = []
+    for ids, error in zip(batches, errors):
+        if error is None:
+            cancelled.extend(ids)
+        else:
+            failed.append((ids, error))
+    metrics.inc('j2pbs_cancelled_jobs_total', len(cancelled), backend=backend.name)
+    if failed:
+        metrics.inc('j2pbs_cancel_failures_total', len(failed), backend=backend.name)
+    return cancelled, failed
@@ -21,3 +21,50 @@ class RepeatJobNameOrId(ConfFileSyntaxError):
 
     def __str__(self):
         return self.msg
+
+class VariableLoopReference(ConfFileSyntaxError):
+    """ There are loop in variables reference relationship. """
+    def __init__(self, var_key=""):
+        self.msg = "There are loop in variables reference, at variable '{}'.".format(var_key)
+
+    def __str__(self):
+        return self.msg
+
+class JobBuildError(ConfFileSyntaxError):
+    """ Some jobs failed to build. """
+    def __init__(self, errors=()):
+        self.errors = list(errors) # list of (job id, error message)
+        details = "; ".join("job {}: {}".format(id_, msg) for id_, msg in self.errors)
+        self.msg = "{} jobs failed to build: {}".format(len(self.errors), details)
+
+    def __str__(self):
+        return self.msg
+
+class SnapshotFormatError(ValueError):
+    """ Invalid graph snapshot file. """
+    pass
+
+class SubmitError(Exception):
+    """ Failed to submit a job. """
+    def __init__(self, job_name="", command=""):
+        self.msg = "Failed to submit job '{}' with command: {}".format(job_name, command)
+
+    def __str__(self):
+        return self.msg
+
+class InvalidResources(ConfFileSyntaxError):
+    """ Invalid job resources request. """
+    pass
+
+class CommandError(OSError):
+    """ A scheduler command exited with non-zero status. """
+    def __init__(self, argv=(), returncode=1, output="", stderr=""):
+        self.argv = list(argv)
+        self.returncode = returncode
+        self.output = output # stdout, may be partial
+        self.stderr = stderr
+        self.msg = "Command '{}' exited with status {}: {}".format(
+                " ".join(self.argv), returncode, stderr.strip())
+
+    def __str__(self):
+        return self.msg
@@ -0,0 +1,187 @@
+import os
+import math
+import time
+import sqlite3
+import hashlib
+
+from .pbs_utils import run_command
+from .resources import parse_size, parse_walltime
+from .metrics import REGISTRY as metrics
+
+"""
+history
+~~~~~~~
+Runtime history of jobs, stored in a local SQLite database.
+
+The actual runtime and peak memory of finished jobs are fetched from
+the scheduler accounting (`qstat -f`, `qstat -x -f` or `sacct`, see `j2pbs.backends`),
+keyed by job name and the fingerprint of it's commands,
+the scheduler job ids are found in the record file (see `j2pbs.records`).
+
+Later conversions can fill in or tighten the `walltime` and `mem` of jobs
+from a high percentile of the successful runs, with a safety margin:
+
+>>> history = History()
+>>> history.collect(graph, read_record("pipeline.json.ids"))
+>>> apply_history(graph, history)
+>>> print(graph.control_script)
+
+Estimates are made only when a job has enough successful runs,
+array jobs are not recorded.
+
+"""
+
+DEFAULT_PATH = os.path.join(os.path.expanduser("~"), ".j2pbs", "history.sqlite")
+
+PERCENTILE = 95    # percentile of the successful runs
+MARGIN = 1.2       # the estimate is the percentile times the margin
+MIN_SAMPLES = 3    # no estimate for jobs with less successful runs
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    name        TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    job_id      TEXT NOT NULL,
+    ok          INTEGER NOT NULL,
+    runtime     REAL,
+    mem         REAL,
+    recorded    REAL NOT NULL,
+    UNIQUE (name, job_id)
+);
+CREATE INDEX IF NOT EXISTS runs_job ON runs (name, fingerprint);
+"""
+
+
+def command_fingerprint(job):
+    """ Digest of the job's commands after variable substitution. """
+    return hashlib.sha1("\n".join(job.commands).encode('utf-8')).hexdigest()[:16]
+
+
+def percentile(values, q):
+    """ The nearest-rank percentile of values. """
+    values = sorted(values)
+    k = int(math.ceil(q / 100.0 * len(values))) - 1
+    return values[max(k, 0)]
+
+
+def format_walltime(seconds):
+    """ Seconds to "HH:MM:SS", rounded up to whole minutes. """
+    minutes = max(int(math.ceil(seconds / 60.0)), 1)
+    return "{:02d}:{:02d}:00".format(minutes // 60, minutes % 60)
+
+
+def format_mem(size):
+    """ Bytes to "<N>mb", rounded up. """
+    return "{}mb".format(max(int(math.ceil(size / 1024.0 ** 2)), 1))
+
+
+class History(object):
+    """
+    The runtime history database.
+
+    :path: the SQLite database file, created if not exists. [~/.j2pbs/history.sqlite]
+
+    """
+
+    def __init__(self, path=DEFAULT_PATH):
+        dirname = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.path = path
+        self.conn = sqlite3.connect(path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, name, fingerprint, job_id, usage):
+        """
+        Add a finished run, `usage` is a `j2pbs.backends.Usage`.
+        return False if the run is already recorded.
+        """
+        with self.conn:
+            cur = self.conn.execute(
+                    "INSERT OR IGNORE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (name, fingerprint, job_id, int(bool(usage.ok)),
+                     usage.runtime, usage.mem, time.time()))
+        return cur.rowcount > 0
+
+    def samples(self, name, fingerprint, key):
+        """ Values of 'runtime' or 'mem' of the successful runs of a job. """
+        if key not in ('runtime', 'mem'):
+            raise ValueError("key must be 'runtime' or 'mem'.")
+        rows = self.conn.execute(
+                "SELECT {0} FROM runs WHERE name = ? AND fingerprint = ?"
+                " AND ok = 1 AND {0} IS NOT NULL".format(key),
+                (name, fingerprint))
+        return [row[0] for row in rows]
+
+    def estimate(self, job, q=PERCENTILE, margin=MARGIN, min_samples=MIN_SAMPLES):
+        """
+        Estimate the resources of job from it's history,
+        return a dict may contain 'walltime' and 'mem'.
+        """
+        fingerprint = command_fingerprint(job)
+        estimates = {}
+        runtimes = self.samples(job.name, fingerprint, 'runtime')
+        if len(runtimes) >= min_samples:
+            estimates['walltime'] = format_walltime(percentile(runtimes, q) * margin)
+        mems = self.samples(job.name, fingerprint, 'mem')
+        if len(mems) >= min_samples:
+            estimates['mem'] = format_mem(percentile(mems, q) * margin)
+        return estimates
+
+    def collect(self, graph, name2id, batch=500, run=run_command):
+        """
+        Record the finished jobs of a submitted graph.
+
+        :name2id: dict mapping job name to scheduler job id, see `j2pbs.records`.
+        :batch: the max number of job ids query in one accounting command. [500]
+
+        return the number of new recorded runs.
+        """
+        backend = graph.backend
+        id2job = {}
+        for job in graph.jobs:
+            if job.name in name2id and not job.array:
+                id2job[name2id[job.name]] = job
+        ids = list(id2job)
+        n = 0
+        for i in range(0, len(ids), batch):
+            usages = backend.parse_accounting(
+                    backend.query(backend.accounting_argv(ids[i:i+batch]), run))
+            for id_, usage in usages.items():
+                job = id2job.get(id_)
+                if job is not None and self.add(job.name, command_fingerprint(job), id_, usage):
+                    n += 1
+        metrics.inc('j2pbs_history_runs_total', n)
+        return n
+
+
+def apply_history(graph, history, tighten=False, **kwargs):
+    """
+    Set the 'walltime' and 'mem' of jobs in graph from their history.
+
+    Resources not requested are filled in,
+    requested ones are lowered to the estimate only if `tighten`,
+    requests are never raised.
+    Keyword arguments are passed to `History.estimate`.
+    return the number of changed jobs.
+
+    """
+    parsers = {'walltime': parse_walltime, 'mem': parse_size}
+    n = 0
+    for job in graph.jobs:
+        estimates = history.estimate(job, **kwargs)
+        updates = {}
+        for key, value in estimates.items():
+            if key not in job.resources:
+                updates[key] = value
+            elif tighten and parsers[key](value) < parsers[key](job.resources[key]):
+                updates[key] = value
+        if updates:
+            resources = dict(job.resources) # may be shared with other jobs
+            resources.update(updates)
+            job.resources = resources
+            n += 1
+    return n
@@ -1,3 +1,5 @@
+import os
+
 from .exceptions import ConfFileSyntaxError
 
 """
@@ -48,9 +50,37 @@ def extract_queue(js_dict, default_queue):
 
 
 def extract_resources(js_dict, default_resources):
+    """ Resources merged key by key with the default resources. """
     aliases = ('RES', 'RESOURCES', 'RESOURCE')
-    resources = fuzzy_get(js_dict, aliases, default_resources)
-    return resources
+    resources = fuzzy_get(js_dict, aliases, {})
+    if type(resources) != dict:
+        raise ConfFileSyntaxError("RESOURCES is must a object/dict.")
+    merged = dict(default_resources or {})
+    merged.update(resources)
+    return merged
+
+
+def extract_profiles(graph_dict):
+    aliases = ('PROFILES', 'PROFILE')
+    profiles = fuzzy_get(graph_dict, aliases, {})
+    if type(profiles) != dict or any(type(p) != dict for p in profiles.values()):
+        raise ConfFileSyntaxError("PROFILES is must a object/dict of resources.")
+    return profiles
+
+
+def extract_profile(job_dict):
+    aliases = ('PROFILE',)
+    return fuzzy_get(job_dict, aliases, None)
+
+
+def extract_autosize(graph_dict):
+    aliases = ('AUTOSIZE', 'AUTO_SIZE')
+    autosize = fuzzy_get(graph_dict, aliases, None)
+    if autosize is None:
+        return None
+    if type(autosize) != dict or 'var' not in autosize:
+        raise ConfFileSyntaxError("AUTOSIZE is must a object/dict contain 'var' and 'rules'.")
+    return autosize
 
 
 def extract_scope(js_dict):
@@ -71,7 +101,10 @@ def extract_commands(job_dict):
     return commands
 
 
-def extract_dependent(job_dict):
+DEPEND_TYPES = ('afterok', 'afterany', 'afternotok', 'afterokarray')
+
+
+def _depend_entries(job_dict):
     aliases = ('DEPEND', 'DEPENDENT', 'DEPENDENCE', 'DEPENDENCES')
     dependent = fuzzy_get(job_dict, aliases, [])
     if type(dependent) is not list:
@@ -79,6 +112,44 @@ def extract_dependent(job_dict):
     return dependent
 
 
+def extract_dependent(job_dict):
+    """
+    Return the list of depended job ids,
+    an entry can be a job id or an object like {"id": 0, "type": "afterany"}.
+    """
+    dependent = []
+    for entry in _depend_entries(job_dict):
+        if type(entry) is dict:
+            entry = upper_dict_key(entry)
+            if 'ID' not in entry:
+                raise ConfFileSyntaxError("Dependent object must contain ID field.")
+            entry = entry['ID']
+        dependent.append(entry)
+    return dependent
+
+
+def extract_depend_types(job_dict):
+    """
+    Return a dict mapping depended job id to dependent type, except 'afterok'.
+    Raise ConfFileSyntaxError if a job is depended with different types.
+    """
+    types = {}
+    for entry in _depend_entries(job_dict):
+        if type(entry) is dict:
+            entry = upper_dict_key(entry)
+            id_ = entry.get('ID')
+            type_ = str(entry.get('TYPE', 'afterok')).lower()
+            if type_ not in DEPEND_TYPES:
+                raise ConfFileSyntaxError("Unknown dependent type '{}', supported: {}".format(
+                    type_, ", ".join(DEPEND_TYPES)))
+        else:
+            id_, type_ = entry, 'afterok'
+        if types.setdefault(id_, type_) != type_:
+            raise ConfFileSyntaxError("Job depends on '{}' with different types: {}, {}".format(
+                id_, types[id_], type_))
+    return {id_: type_ for id_, type_ in types.items() if type_ != 'afterok'}
+
+
 def extract_jobs(graph_dict):
     aliases = ("JOB", "JOBS", "NODES")
     jobs = fuzzy_get(graph_dict, aliases, [])
@@ -87,3 +158,42 @@ def extract_jobs(graph_dict):
     if jobs == []:
         raise ConfFileSyntaxError("Graph at least contain one job.")
     return jobs
+
+
+def extract_array(job_dict):
+    aliases = ('ARRAY', 'ARRAYS')
+    array = fuzzy_get(job_dict, aliases, None)
+    if array is not None:
+        array = str(array)
+    return array
+
+
+def extract_backend(graph_dict, default_backend):
+    aliases = ('SCHEDULER', 'BACKEND')
+    backend = fuzzy_get(graph_dict, aliases, default_backend)
+    return backend
+
+
+def extract_includes(graph_dict):
+    """
+    Return a list of included graphs, as (path, namespace, dependent, depend types) tuples,
+    an entry can be a path or an object like {"path": "qc.json", "as": "qc", "depend": 0},
+    "depend" is in the same form of job's, see `extract_depend_types`.
+    """
+    aliases = ('INCLUDE', 'INCLUDES', 'IMPORT')
+    includes = fuzzy_get(graph_dict, aliases, [])
+    if type(includes) is not list:
+        includes = [includes]
+    res = []
+    for entry in includes:
+        if type(entry) is not dict:
+            entry = {'PATH': entry}
+        entry = upper_dict_key(entry)
+        path = fuzzy_get(entry, ('PATH', 'FILE'), None)
+        if not path:
+            raise ConfFileSyntaxError("Include object must contain PATH field.")
+        namespace = fuzzy_get(entry, ('AS', 'NAMESPACE', 'NAME'), None)
+        if not namespace:
+            namespace = os.path.splitext(os.path.basename(path))[0]
+        res.append((path, str(namespace), extract_dependent(entry), extract_depend_types(entry)))
+    return res
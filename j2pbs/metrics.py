@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+"""
+metrics
+~~~~~~~
+Collect metrics of graph building, rendering and submission,
+export them as JSON lines or Prometheus textfile format.
+
+All metrics are recorded in the module level registry `REGISTRY`:
+>>> from j2pbs.metrics import REGISTRY
+>>> REGISTRY.inc("j2pbs_submit_failures_total", backend="pbs")
+>>> with REGISTRY.timer("j2pbs_graph_build_seconds"):
+...     g = Graph(js_dict)
+>>> REGISTRY.write("metrics.prom", fmt="prom")
+
+Metrics recorded by j2pbs:
+
+    | j2pbs_graph_build_seconds     (histogram) time of building a Graph
+    | j2pbs_graph_jobs              (histogram) jobs per graph
+    | j2pbs_render_seconds          (histogram) time of rendering control script
+    | j2pbs_rendered_bytes_total    (counter)   bytes of rendered scripts
+    | j2pbs_submit_seconds          (histogram) latency of submit command
+    | j2pbs_submitted_jobs_total    (counter)   jobs submitted
+    | j2pbs_submit_retries_total    (counter)   retries of submit command
+    | j2pbs_submit_failures_total   (counter)   jobs failed to submit
+    | j2pbs_poll_failures_total     (counter)   failed status commands
+    | j2pbs_skipped_jobs_total      (counter)   jobs not submitted, their dependences failed
+    | j2pbs_cancelled_jobs_total    (counter)   jobs cancelled
+    | j2pbs_cancel_failures_total   (counter)   failed cancel commands
+    | j2pbs_job_cache_hits_total    (counter)   jobs restored from the job cache
+    | j2pbs_watch_convert_seconds   (histogram) time of converting again in watch mode
+    | j2pbs_history_runs_total      (counter)   finished runs recorded to the history
+
+The submit and poll metrics are recorded only when jobs are submitted
+from python (`j2pbs.submitter`), not by running the control script.
+
+"""
+
+FORMATS = ('jsonl', 'prom')
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+
+
+class Histogram(object):
+    """ Cumulative histogram, like the Prometheus histogram. """
+
+    def __init__(self, buckets=TIME_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, le in enumerate(self.buckets):
+            if value <= le:
+                self.counts[i] += 1
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'buckets': {str(le): c for le, c in zip(self.buckets, self.counts)},
+        }
+
+
+class Metrics(object):
+    """ A registry of counters, gauges and histograms, with labels. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.types = {} # name -> 'counter' / 'gauge' / 'histogram'
+        self.values = {} # (name, labels) -> value or Histogram
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def _check_type(self, name, type_):
+        if self.types.setdefault(name, type_) != type_:
+            raise ValueError("Metric '{}' is a {}.".format(name, self.types[name]))
+
+    def inc(self, name, value=1, **labels):
+        """ Increase a counter. """
+        with self.lock:
+            self._check_type(name, 'counter')
+            key = self._key(name, labels)
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        """ Set a gauge. """
+        with self.lock:
+            self._check_type(name, 'gauge')
+            self.values[self._key(name, labels)] = value
+
+    def observe(self, name, value, buckets=TIME_BUCKETS, **labels):
+        """ Observe a value of histogram, buckets are fixed at the first observation. """
+        with self.lock:
+            self._check_type(name, 'histogram')
+            key = self._key(name, labels)
+            if key not in self.values:
+                self.values[key] = Histogram(buckets)
+            self.values[key].observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """ Observe the seconds spent in the with block. """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def get(self, name, **labels):
+        """ Get the value of a metric, None if not recorded. """
+        return self.values.get(self._key(name, labels))
+
+    def samples(self):
+        """ Return the list of (name, type, labels dict, value). """
+        with self.lock:
+            return [(name, self.types[name], dict(labels), value)
+                    for (name, labels), value in sorted(self.values.items(), key=lambda kv: kv[0])]
+
+    def to_jsonl(self):
+        """ Metrics in JSON lines format, one sample per line. """
+        now = time.time()
+        lines = []
+        for name, type_, labels, value in self.samples():
+            record = {'time': now, 'name': name, 'type': type_, 'labels': labels}
+            if type_ == 'histogram':
+                record.update(value.to_dict())
+            else:
+                record['value'] = value
+            lines.append(json.dumps(record, sort_keys=True))
+        return "".join(line + "\n" for line in lines)
+
+    def to_prometheus(self):
+        """ Metrics in Prometheus text exposition format. """
+        def fmt_labels(labels, extra=()):
+            items = sorted(labels.items()) + list(extra)
+            if not items:
+                return ""
+            return "{" + ",".join('{}="{}"'.format(k, str(v).replace('"', '\\"'))
+                                  for k, v in items) + "}"
+
+        lines = []
+        typed = set()
+        for name, type_, labels, value in self.samples():
+            if name not in typed:
+                lines.append("# TYPE {} {}".format(name, type_))
+                typed.add(name)
+            if type_ == 'histogram':
+                for le, c in zip(value.buckets, value.counts):
+                    lines.append("{}_bucket{} {}".format(name, fmt_labels(labels, [('le', le)]), c))
+                lines.append("{}_bucket{} {}".format(name, fmt_labels(labels, [('le', '+Inf')]), value.count))
+                lines.append("{}_sum{} {}".format(name, fmt_labels(labels), value.sum))
+                lines.append("{}_count{} {}".format(name, fmt_labels(labels), value.count))
+            else:
+                lines.append("{}{} {}".format(name, fmt_labels(labels), value))
+        return "".join(line + "\n" for line in lines)
+
+    def write(self, path, fmt='jsonl'):
+        """
+        Write metrics to a local file.
+
+        :fmt: 'jsonl', append to the file,
+              or 'prom', replace the file atomically (for textfile collectors). ['jsonl']
+
+        """
+        if fmt == 'jsonl':
+            with open(path, 'a') as f:
+                f.write(self.to_jsonl())
+        elif fmt == 'prom':
+            tmp = "{}.{}.tmp".format(path, os.getpid())
+            with open(tmp, 'w') as f:
+                f.write(self.to_prometheus())
+            os.rename(tmp, path)
+        else:
+            raise ValueError("fmt must be one of: " + ", ".join(FORMATS))
+
+
+REGISTRY = Metrics()
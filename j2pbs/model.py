@@ -1,22 +1,32 @@
 import os
+import json
+import time
 import uuid
+import hashlib
+import heapq
 import shlex
+import multiprocessing
 
 from .json_utils import upper_dict_key, lower_dict_key
 from .json_utils import extract_dir, extract_queue, extract_resources, extract_scope
-from .json_utils import extract_commands, extract_dependent
-from .json_utils import extract_jobs
+from .json_utils import extract_commands, extract_dependent, extract_depend_types
+from .json_utils import extract_jobs, extract_array, extract_backend, extract_includes
+from .json_utils import extract_profiles, extract_profile, extract_autosize
 from .exceptions import ConfFileSyntaxError, GraphLoopDependent, RepeatJobNameOrId
-from .semantic import var_sub
+from .exceptions import JobBuildError
+from .semantic import var_sub, resolve_scope
+from .resources import merge_resources, autosize_resources, get_profile, validate_resources
+from .backends import get_backend
+from .metrics import REGISTRY as metrics, SIZE_BUCKETS
 
 # defaults
 SHELL_SCOPE = os.environ
 RESOURCES = {'nodes': 1, 'ppn': 1}
-QUEUE = 'batch'
+QUEUE = None # not set, use the default queue of the scheduler
 DIR   = "$PWD"
 SHELL = False
 
-class Job:
+class Job(object):
     """
     The abstraction of one PBS job.
 
@@ -24,14 +34,17 @@ class Job:
 
         | id:    (int) job identifier
         | name:  (str) 
-        | queue: (str) job queue [batch]
+        | queue: (str) job queue [the scheduler's default]
         | dir:   (str) working directory [$HOME]
         | resources:
         |     nodes: (int/str) nodes name or number [1]
         |     ppn:   (int) MPI processes per node [1]
         |     mem:   (str) memory
         |     walltime: (str)
-        | dependences: (list) only supprt "afterok" type
+        | profile: (str) name of a resources profile defined in graph
+        | array: (str) array job index range, like "1-10"
+        | dependences: (list) depended job ids, or objects like {"id": 0, "type": "afterany"}
+        |     types: afterok(default), afterany, afternotok, afterokarray
 
         Not all, just some PBS features common use. :( 
         "id" is virtual id, for specify dependence relationship.
@@ -42,6 +55,8 @@ class Job:
         1. supported the shell variable, 
            'SHELL' control use it or not in default condition.
         2. priority of variables: LOCAL > GLOBAL > SHELL
+        3. variables can reference other variables,
+           local variables can reference global and shell variables.
 
     Init a Job:
     >>> js_dict = json.loads(json_str)
@@ -51,6 +66,10 @@ class Job:
     >>> print(job.pbs_script)
     ...
 
+    or the script of other scheduler (see `j2pbs.backends`):
+    >>> print(job.render("slurm"))
+    ...
+
     """
 
     def __init__(self, job_dict, 
@@ -59,7 +78,9 @@ class Job:
                  default_dir=DIR,
                  default_queue=QUEUE,
                  default_resources=RESOURCES,
-                 default_shell=SHELL):
+                 default_shell=SHELL,
+                 profiles={},
+                 autosize=None):
         job_dict = upper_dict_key(job_dict) # upper case all keys
 
         # extract ID and NAME
@@ -73,12 +94,13 @@ class Job:
         self.dir       = extract_dir(job_dict, default_dir)
         self.queue     = extract_queue(job_dict, default_queue)
         self.commands  = extract_commands(job_dict)
-        self.resources = extract_resources(job_dict, default_resources)
         self.dependent = extract_dependent(job_dict)
+        self.depend_types = extract_depend_types(job_dict) # id -> type, except 'afterok'
+        self.array     = extract_array(job_dict)
 
         # construct scopes
         self.local_scope = extract_scope(job_dict)
-        self.global_scope = global_scope
+        self.global_scope = global_scope # global scope is resolved by Graph
 
         shell = job_dict.get('SHELL', default_shell)
         if shell == 0: # 0 count as False
@@ -91,43 +113,71 @@ class Job:
         if shell: 
             self.scope.update(SHELL_SCOPE) # priority: shell < global < local
         self.scope.update(self.global_scope)
+        if self.local_scope: # local variables can reference global and shell variables
+            self.local_scope = resolve_scope(self.local_scope, self.scope)
         self.scope.update(self.local_scope)
 
+        # resources, priority: default < profile or auto-sizing < job resources,
+        # a job with a profile is not auto-sized
+        profile = extract_profile(job_dict)
+        if profile is not None:
+            sized = get_profile(profiles, profile)
+        elif autosize:
+            sized = autosize_resources(autosize, self.scope, profiles)
+        else:
+            sized = None
+        self.resources = extract_resources(job_dict, merge_resources(default_resources, sized))
+        validate_resources(self.resources)
+
         if cmd_sub: # variable subsititute
             self.cmd_sub()
         self.dir_sub()
 
+    def render(self, backend=None, with_name=True):
+        """
+        Convert to the job script of a scheduler backend.
+
+        :backend: backend name or instance, see `j2pbs.backends`. ['pbs']
+        :with_name: include the job name in the header. [True]
+
+        """
+        return get_backend(backend).render(self, with_name=with_name)
+
     @property
     def pbs_script(self):
         """ Convert to pbs script string. """
-        header_name = "#PBS -N {}".format(self.name)
-        header_queue = "#PBS -q {}".format(self.queue)
-        header_dir = "#PBS -d {}".format(self.dir)
-
-        # generate resource header
-        header_resource = ""
-        if ('nodes' in self.resources) and ('ppn' in self.resources):
-            nodes, ppn = self.resources['nodes'], self.resources['ppn']
-            header_resource += "#PBS -l nodes={}:ppn={}\n".format(nodes, ppn)
-            self.resources = self.resources.copy() # if not copy, will change the class variable: RESOURCES
-            del self.resources['nodes']
-            del self.resources['ppn']
-        elif ('ppn' in self.resources) and ('nodes' not in self.resources):
-            raise ConfFileSyntaxError("Resources can't only contain ppn without nodes")
-        for k, v in self.resources.items():
-            header_resource += "#PBS -l {}={}\n".format(k, v)
-
-        content = "\n".join(self.commands)
-
-        # construct script string
-        script = ""
-        script += header_name + "\n"
-        script += header_dir + "\n"
-        script += header_queue + "\n"
-        script += header_resource
-        script += content
+        return self.render('pbs')
 
-        return script
+    @property
+    def pbs_body(self):
+        """
+        The pbs script without the job name header,
+        jobs with same settings and commands share the same body,
+        the name can be passed to qsub with '-N' option.
+        """
+        return self.render('pbs', with_name=False)
+
+    @property
+    def record(self):
+        """
+        Compact tuple of the job's fields after substitution,
+        cheap to pickle or store, use `Job.from_record` to restore it.
+        """
+        return (self.id, self.name, self.dir, self.queue,
+                self.commands, self.resources, self.dependent, self.array,
+                self.depend_types)
+
+    @classmethod
+    def from_record(cls, record):
+        """ Construct a Job from a record, without parsing and substitution. """
+        job = cls.__new__(cls)
+        (job.id, job.name, job.dir, job.queue,
+         job.commands, job.resources, job.dependent, job.array,
+         job.depend_types) = record
+        job.local_scope = {}
+        job.global_scope = {}
+        job.scope = {}
+        return job
 
     def cmd_sub(self, scope=None, comment="*"):
         """
@@ -158,11 +208,13 @@ class Job:
         return self.pbs_script
 
 
-class Graph:
+class Graph(object):
     """
     The abstraction of pbs jobs relationship graph. 
     Convert the json dict to the control script,
     according to the dependent relationship between jobs.
+    Scripts are rendered by the scheduler backend,
+    specified by 'scheduler' field or the 'backend' argument. [pbs]
 
     In the same time it also provide the global varibles scope, 
     and the default settings for Jobs.
@@ -175,9 +227,26 @@ class Graph:
     >>> print(g.control_script)
     ...
 
+    Other json graphs can be included, their jobs's ids and names are
+    prefixed by the namespace, like "qc.0" and "qc_fastqc",
+    jobs can depend on the namespace, it means the sink jobs of the included graph.
+    Included files are parsed once, and cached by path and modify time.
+    Relative paths are relative to `base_dir`. [current directory]
+
+    Graphs built for including (`included=True`) don't record the build metrics.
+
+    Pass the same dict as `job_cache` when rebuilding a graph after an edit,
+    jobs whose json and graph defaults are unchanged are not built again
+    (except the jobs may be auto-sized by file sizes):
+    >>> cache = {}
+    >>> g = Graph(js_dict, job_cache=cache)
+    >>> g = Graph(edited_js_dict, job_cache=cache)
+
     """
 
-    def __init__(self, graph_dict):
+    def __init__(self, graph_dict, processes=None, chunksize=1000, backend=None, reduce=None,
+                 base_dir=None, job_cache=None, included=False):
+        start_time = time.time()
         graph_dict = upper_dict_key(graph_dict)
 
         name = graph_dict.get('NAME', None)
@@ -185,37 +254,252 @@ class Graph:
             name = uuid.uuid4().hex[:8] # default name is an unique id
         self.name = name
 
+        # scheduler backend, argument 'backend' override the config file
+        self.backend = get_backend(backend or extract_backend(graph_dict, None))
+
         # extract job default properties
         self.job_default_dir = extract_dir(graph_dict, None) or DIR
         self.job_default_queue = extract_queue(graph_dict, None) or QUEUE
-        self.job_default_resources = extract_resources(graph_dict, None) or RESOURCES
+        self.job_default_resources = extract_resources(graph_dict, RESOURCES) # merged with RESOURCES
+        self.job_profiles = extract_profiles(graph_dict)
+        self.job_autosize = extract_autosize(graph_dict)
         self.job_default_shell = graph_dict.get('SHELL', None) or SHELL
-        # extract graph scopy(job global scopy)
-        self.scope = extract_scope(graph_dict)
+        # extract graph scopy(job global scopy),
+        # resolve the references between variables once, shared by all jobs.
+        outer_scope = SHELL_SCOPE if self.job_default_shell else {}
+        self.scope = resolve_scope(extract_scope(graph_dict), outer_scope)
+
+        self.jobs = list(extract_jobs(graph_dict)) # copy, keep the input dict unchanged
+        self.init_jobs(processes, chunksize, job_cache) # init job objects
+
+        self.sources = [] # paths of included files
+        self.namespaces = {} # namespace -> ids of sink jobs
+        includes = extract_includes(graph_dict)
+        if includes:
+            self.include_graphs(includes, base_dir or os.getcwd())
 
-        self.jobs = extract_jobs(graph_dict)
-        self.init_jobs() # init job objects
         self.check_jobs()
         self.parse_dependent()
 
-    def init_jobs(self):
-        """ init jobs, convert json dicts to Job object. """
-        for i, js_dict in enumerate(self.jobs):
-            self.jobs[i] = Job(
-                    js_dict,
-                    global_scope=self.scope,
-                    default_dir=self.job_default_dir,
-                    default_queue=self.job_default_queue,
-                    default_resources=self.job_default_resources,
-                    default_shell=self.job_default_shell)
+        # remove redundant dependent edges, argument 'reduce' override the config file
+        if reduce is None:
+            reduce = graph_dict.get('REDUCE', True)
+        if reduce:
+            try:
+                self.reduce_dependent()
+            except GraphLoopDependent: # keep it, raise when convert to control script
+                pass
+
+        if not included: # included graphs are counted in the including graph
+            metrics.observe('j2pbs_graph_build_seconds', time.time() - start_time)
+            metrics.observe('j2pbs_graph_jobs', len(self.jobs), buckets=SIZE_BUCKETS)
+
+    @classmethod
+    def from_file(cls, path, **kwargs):
+        """
+        Load Graph from a json file,
+        relative include paths in it are relative to the file.
+        """
+        with open(path) as f:
+            graph_dict = json.load(f)
+        kwargs.setdefault('base_dir', os.path.dirname(os.path.abspath(path)))
+        return cls(graph_dict, **kwargs)
+
+    def include_graphs(self, includes, base_dir):
+        """
+        Add jobs of included graphs to self.jobs, with namespaced ids and names.
+
+        :includes: list of (path, namespace, dependent ids, depend types) tuples,
+                   source jobs of the included graph depend on the dependent ids,
+                   with the depend types (id -> type, except 'afterok').
+        :base_dir: the directory relative paths relative to.
+
+        """
+        for path, namespace, dependent, depend_types in includes:
+            path = os.path.abspath(os.path.join(base_dir, path))
+            sub = load_included_graph(path)
+            self.sources.extend(sub.sources)
+            self.sources.append(path)
+
+            def ns_id(job):
+                return "{}.{}".format(namespace, job.id)
+
+            depended = set()
+            for job in sub.jobs:
+                depended.update(sub.dependent[job])
+            for job in sub.jobs:
+                deps = sub.dependent[job]
+                record = list(job.record)
+                record[0] = ns_id(job)
+                record[1] = "{}_{}".format(namespace, job.name)
+                if deps:
+                    record[6] = [ns_id(j) for j in deps]
+                    record[8] = {ns_id(j): sub.depend_type(job, j) for j in deps
+                                 if sub.depend_type(job, j) != 'afterok'}
+                else: # source job, depends on the include's dependent
+                    record[6] = list(dependent)
+                    record[8] = dict(depend_types)
+                self.jobs.append(Job.from_record(tuple(record)))
+            self.namespaces[namespace] = [ns_id(j) for j in sub.jobs if j not in depended]
+
+    @classmethod
+    def from_jobs(cls, name, jobs, backend=None, dependent=None):
+        """
+        Construct a Graph from built Job objects,
+        without parsing json dict and variable substitution.
+
+        :dependent: dict mapping job to the jobs it depends on,
+                    parsed from the jobs's dependent ids if None. [None]
+        """
+        graph = cls.__new__(cls)
+        graph.name = name
+        graph.backend = get_backend(backend)
+        graph.job_default_dir = DIR
+        graph.job_default_queue = QUEUE
+        graph.job_default_resources = RESOURCES
+        graph.job_default_shell = SHELL
+        graph.job_profiles = {}
+        graph.job_autosize = None
+        graph.scope = {}
+        graph.sources = []
+        graph.namespaces = {}
+        graph.jobs = list(jobs)
+        graph.check_jobs()
+        if dependent is None:
+            graph.parse_dependent()
+        else:
+            graph.dependent = dependent
+        return graph
+
+    @property
+    def job_kwargs(self):
+        """ Keyword arguments for init Job objects of this graph. """
+        return {
+            'global_scope': self.scope,
+            'default_dir': self.job_default_dir,
+            'default_queue': self.job_default_queue,
+            'default_resources': self.job_default_resources,
+            'default_shell': self.job_default_shell,
+            'profiles': self.job_profiles,
+            'autosize': self.job_autosize,
+        }
+
+    def init_jobs(self, processes=None, chunksize=1000, job_cache=None):
+        """
+        init jobs, convert json dicts to Job object.
+
+        :processes: number of worker processes, build jobs in parallel
+                    when it's greater than 1. [None]
+        :chunksize: number of jobs sent to a worker at a time. [1000]
+        :job_cache: dict mapping job content digest to job record,
+                    hit jobs are restored from their records, the others are built
+                    and stored, entries of jobs no longer in the graph are dropped,
+                    jobs may be auto-sized are not cached. [None]
+
+        """
+        if job_cache is None:
+            self.jobs = self.build_jobs(self.jobs, processes, chunksize)
+            return
+        job_kwargs = self.job_kwargs
+        defaults = json.dumps(job_kwargs, sort_keys=True, default=str)
+        # auto-sized jobs depend on the size of files, they are always built
+        autosize = job_kwargs['autosize']
+        keys = [None if autosize and extract_profile(upper_dict_key(js_dict)) is None
+                else job_digest(js_dict, defaults) for js_dict in self.jobs]
+        missed = [i for i, key in enumerate(keys) if key is None or key not in job_cache]
+        built = self.build_jobs([self.jobs[i] for i in missed], processes, chunksize)
+        for i, job in zip(missed, built):
+            if keys[i] is None:
+                self.jobs[i] = job
+            else:
+                job_cache[keys[i]] = job.record
+        used = set(keys)
+        for key in list(job_cache):
+            if key not in used:
+                del job_cache[key]
+        for i, key in enumerate(keys):
+            if key is None:
+                continue
+            record = job_cache[key]
+            # copy depend types, they are updated by expanding namespaces
+            self.jobs[i] = Job.from_record(record[:8] + (dict(record[8]),))
+        metrics.inc('j2pbs_job_cache_hits_total', len(keys) - len(missed))
+
+    def build_jobs(self, job_dicts, processes=None, chunksize=1000):
+        """ Build Job objects from json dicts, see `init_jobs`. """
+        if processes and processes > 1 and len(job_dicts) > chunksize:
+            return build_jobs_parallel(job_dicts, self.job_kwargs, processes, chunksize)
+        job_kwargs = self.job_kwargs
+        return [Job(js_dict, **job_kwargs) for js_dict in job_dicts]
 
     def parse_dependent(self):
-        """ Fetch all jobs dependent store in self.dependent. """
+        """
+        Fetch all jobs dependent store in self.dependent.
+        Dependent on a namespace of included graph is expanded to it's sink jobs.
+        """
         id2job = {job.id:job for job in self.jobs}
+        namespaces = self.namespaces
         self.dependent = {}
         for job in self.jobs:
-            ids = job.dependent
-            self.dependent[job] = [id2job[_id] for _id in ids]
+            deps = []
+            for _id in job.dependent:
+                if (_id not in id2job) and (_id in namespaces):
+                    type_ = job.depend_types.get(_id)
+                    for sink_id in namespaces[_id]:
+                        deps.append(id2job[sink_id])
+                        if type_:
+                            job.depend_types[sink_id] = type_
+                else:
+                    deps.append(id2job[_id])
+            self.dependent[job] = deps
+
+    def depend_type(self, job, depended):
+        """ The dependent type of the edge: job depend on depended job. """
+        return job.depend_types.get(depended.id, 'afterok')
+
+    def reduce_dependent(self):
+        """
+        Transitive reduction of the 'afterok' dependent edges.
+
+        Edge A->C is removed if C also depends on A through a chain of
+        'afterok' edges, like A->B->C, the start condition of C is the same.
+        Edges of other types are kept as it is.
+        return the number of removed edges.
+        """
+        order = self.topological_order()
+        index = {job: i for i, job in enumerate(order)}
+        def afterok_parents(job):
+            return [d for d in self.dependent[job] if self.depend_type(job, d) == 'afterok']
+
+        n_removed = 0
+        for job in order:
+            parents = afterok_parents(job)
+            if len(parents) < 2:
+                continue
+            # search the ancestors of the parents, those of lower index than
+            # all the parents can't reach any of them, not searched.
+            lowest = min(index[d] for d in parents)
+            reach = set()
+            stack = [a for d in set(parents) for a in afterok_parents(d)]
+            while stack:
+                j = stack.pop()
+                if j in reach or index[j] < lowest:
+                    continue
+                reach.add(j)
+                stack.extend(afterok_parents(j))
+
+            kept = []
+            seen = set()
+            for d in self.dependent[job]:
+                redundant = (self.depend_type(job, d) == 'afterok') and \
+                            ((d in reach) or (d in seen))
+                if redundant:
+                    n_removed += 1
+                else:
+                    kept.append(d)
+                seen.add(d)
+            self.dependent[job] = kept
+        return n_removed
 
     def check_jobs(self):
         """ jobs validity check. """
@@ -230,6 +514,48 @@ class Graph:
             ids.add(job.id)
             names.add(job.name)
 
+    def descendants(self, job):
+        """ Return the set of jobs depend on job directly or indirectly. """
+        children = {}
+        for j in self.jobs:
+            for d in self.dependent[j]:
+                children.setdefault(d, []).append(j)
+        res = set()
+        stack = [job]
+        while stack:
+            for child in children.get(stack.pop(), []):
+                if child not in res:
+                    res.add(child)
+                    stack.append(child)
+        return res
+
+    def topological_order(self):
+        """
+        Return jobs in the order that every job after the jobs it depends on,
+        ready jobs are ordered by their position in the config file.
+        Raise GraphLoopDependent if there are loop in dependent relationship.
+        """
+        job2index = {job: i for i, job in enumerate(self.jobs)}
+        n_depend = {job: len(self.dependent[job]) for job in self.jobs}
+        children = {job: [] for job in self.jobs}
+        for job in self.jobs:
+            for j in self.dependent[job]:
+                children[j].append(job)
+
+        ready = [job2index[job] for job in self.jobs if n_depend[job] == 0]
+        heapq.heapify(ready)
+        order = []
+        while ready:
+            job = self.jobs[heapq.heappop(ready)]
+            order.append(job)
+            for child in children[job]:
+                n_depend[child] -= 1
+                if n_depend[child] == 0:
+                    heapq.heappush(ready, job2index[child])
+        if len(order) < len(self.jobs):
+            raise GraphLoopDependent()
+        return order
+
     @property
     def job_scripts(self):
         """ 
@@ -243,100 +569,262 @@ class Graph:
             id2script[id_] = script
         return id2script
 
+    @property
+    def job_bodies(self):
+        """
+        Deduplicate the job scripts body,
+        return a list of unique bodies and a dict mapping job to body index.
+        """
+        bodies = []
+        body2index = {}
+        job2body = {}
+        for job in self.jobs:
+            body = job.render(self.backend, with_name=False)
+            if body not in body2index:
+                body2index[body] = len(bodies)
+                bodies.append(body)
+            job2body[job] = body2index[body]
+        return bodies, job2body
+
+    def write_job_dir(self, job_dir, owned_files=None):
+        """
+        Write each unique job body to a file in job_dir,
+        the file name is the digest of the body, existing files are not rewritten.
+        return a dict mapping job to the script file name.
+
+        :owned_files: set of script names written by the caller's earlier conversions,
+                      the ones not used any more are removed, then it's updated
+                      to the current ones. Other files in job_dir, like the scripts
+                      of other graphs sharing it, are never removed. [None]
+
+        """
+        if not os.path.isdir(job_dir):
+            os.makedirs(job_dir)
+        bodies, job2body = self.job_bodies
+        filenames = []
+        for body in bodies:
+            filename = body_digest(body) + ".sh"
+            path = os.path.join(job_dir, filename)
+            if not os.path.exists(path):
+                with open(path, 'w') as f:
+                    f.write(body + "\n")
+                metrics.inc('j2pbs_rendered_bytes_total', len(body) + 1)
+            filenames.append(filename)
+        if owned_files is not None:
+            used = set(filenames)
+            for filename in owned_files - used:
+                path = os.path.join(job_dir, filename)
+                if os.path.exists(path):
+                    os.remove(path)
+            owned_files.clear()
+            owned_files.update(used)
+        return {job: filenames[i] for job, i in job2body.items()}
+
     @property
     def control_script(self):
         """ 
         Create a script control all jobs,
         ensure them run according the dependent relation ship. 
-        
+
+        see `render_control_script`
+        """
+        return self.render_control_script()
+
+    def render_control_script(self, job_dir=None, record=None, owned_files=None):
+        """ 
+        Create a script control all jobs,
+        ensure them run according the dependent relation ship. 
+
+        Each unique job body is written only once,
+        as a shell function feeding qsub with a here document,
+        job name and dependences are passed as qsub options,
+        so no subshell is forked for 'cat' the scripts.
+        Headers and submit commands are rendered by `self.backend`.
+
         The control script will look like this:
         
         ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
         #!/bin/bash
 
-        JOB1_SCR=$(cat <<'EOF'
-        #PBS -N job1
+        _j2pbs_body_0() {
+        qsub "$@" <<'J2PBS_EOF'
+        #PBS -d $PWD
         #PBS -l nodes=1:ppn=1
         sleep 10
-        EOF
-        )
-        JOB2_SCR=$(cat <<'EOF'
-        #PBS -N job2 
-        #PBS -l nodes=1:ppn=1
-        echo "Hello!"
-        EOF
-        )
+        J2PBS_EOF
+        }
 
-        JOB1_ID=$(echo "$JOB1_SCR" | qsub)
+        JOB1_ID=$(_j2pbs_body_0 -N job1)
         echo $JOB1_ID
-        JOB2_ID=$(echo "$JOB2_SCR" | qsub -w afterok:$JOB1_ID)
+        JOB2_ID=$(_j2pbs_body_0 -N job2 -W depend=afterok:$JOB1_ID)
         echo $JOB2_ID
         ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-        """
-        ctrl_scr = ""
-        shebang = "#!/bin/bash"
-        ctrl_scr += (shebang + "\n\n")
+        :job_dir: if specified, write the job bodies to files in this directory,
+                  (see `write_job_dir`) and submit them with 'qsub file'. [None]
+        :record: if specified, append the submitted job names and ids to this file,
+                 (see `j2pbs.records`). [None]
+        :owned_files: scripts in job_dir written by earlier conversions of the caller,
+                      see `write_job_dir`. [None]
 
-        def job_assign_state(job):
+        """
+        start_time = time.time()
+        backend = self.backend
+        lines = ["#!/bin/bash", ""]
+
+        if job_dir is None:
+            bodies, job2body = self.job_bodies
+            submit_command = " ".join(backend.submit_command)
+            for i, body in enumerate(bodies):
+                lines.append("_j2pbs_body_{}() {{".format(i))
+                lines.append("{} \"$@\" <<'J2PBS_EOF'".format(submit_command))
+                lines.append(body)
+                lines.append("J2PBS_EOF")
+                lines.append("}")
+                lines.append("")
+
+            def submit_argv(job, name, depends):
+                options = backend.submit_options(name, depends)
+                return ["_j2pbs_body_{}".format(job2body[job])] + options
+        else:
+            job2file = self.write_job_dir(job_dir, owned_files=owned_files)
+            lines.append("JOB_DIR={}".format(shell_quote(os.path.abspath(job_dir))))
+            lines.append("")
+
+            def submit_argv(job, name, depends):
+                script = "\"$JOB_DIR/{}\"".format(job2file[job])
+                return backend.submit_argv(name, depends, script=script)
+
+        def qsub_and_fetch_state(job):
             """ 
-            return an bash assignment statement, store job script to a variable. 
+            Return an statement, submit the job and fetch job id,
             like:
-                JOB2_SCR=$(cat <<'EOF'
-                    #PBS -N job2 
-                    #PBS -l nodes=1:ppn=1
-
-                    echo "Hello!"
-                EOF
-                )
+                "JOB2_ID=$(_j2pbs_body_0 -N job2 -W depend=afterok:$JOB1_ID)"
             """
-            state = "{}_SCR=$(cat <<'EOF'\n{}\nEOF\n)".format(job.name.upper(), job.pbs_script)
+            depends = [(self.depend_type(job, j), "$" + j.name.upper() + "_ID")
+                       for j in self.dependent[job]]
+            argv = submit_argv(job, job.name, depends)
+            state = "{}_ID=$({})".format(job.name.upper(), " ".join(argv))
             return state
-                    
 
-        for job in self.jobs:
-            ctrl_scr += job_assign_state(job)
-            ctrl_scr += "\n"
-        ctrl_scr += "\n"
+        for job in self.topological_order():
+            lines.append(qsub_and_fetch_state(job))
+            lines.append("echo ${}".format(job.name.upper() + "_ID"))
+            if record is not None:
+                lines.append("printf '%s\\t%s\\n' {} \"${}\" >> {}".format(
+                    job.name, job.name.upper() + "_ID", shell_quote(os.path.abspath(record))))
+            lines.append("")
+
+        script = "\n".join(lines) + "\n"
+        metrics.observe('j2pbs_render_seconds', time.time() - start_time)
+        metrics.inc('j2pbs_rendered_bytes_total', len(script))
+        return script
 
-        status = {job: False for job in self.jobs} # status indicate it is converted or not
+    def __str__(self):
+        return self.control_script
 
-        def is_solved(job):
-            """ The dependent of job is solved or not. """
-            return all([status[j] for j in self.dependent[job]])
 
-        def qsub_and_fetch_state(job, depend_type="afterok"):
-            """ 
-            Return an statement, submit the job and fetch job id,
-            like:
-                "JOB2_ID=$(echo "$JOB2_SCR" | qsub -w afterok:$JOB1_ID)"
-            """
-            dependent_jobs = self.dependent[job]
-            if dependent_jobs == []:
-                state = "{}_ID=$(echo \"${}_SCR\" | qsub)".format(
-                        job.name.upper(), job.name.upper())
-            else:
-                depend_job_names = [j.name.upper() + "_ID" for j in dependent_jobs]
-                depends = [depend_type + ":" + "$" + name for name in depend_job_names]
-                depends = ",".join(depends)
-                state = "{}_ID=$(echo \"${}_SCR\" | qsub -W depend={})".format(
-                        job.name.upper(), job.name.upper(), depends)
-            return state
+_included_graphs = {} # path -> ({file: modify time} of it and it's includes, Graph)
+_including = set()    # paths being loaded, for detect include loop
 
-        # dependence solving loop 
-        n = 0
-        while not all(status.values()):
-            n += 1
-            for job in self.jobs:
-                if is_solved(job):
-                    ctrl_scr += (qsub_and_fetch_state(job) + "\n")
-                    ctrl_scr += ("echo ${}".format(job.name.upper() + "_ID") + "\n")
-                    ctrl_scr += "\n"
-                    status[job] = True
-            if n >= len(self.jobs):
-                raise GraphLoopDependent()
-
-        return ctrl_scr
+def load_included_graph(path):
+    """
+    Load an included graph, cached by path and the modify times
+    of the file and the files it includes, nested ones too.
+    """
+    cached = _included_graphs.get(path)
+    if cached and _mtimes(cached[0]) == cached[0]:
+        return cached[1]
+    if path in _including:
+        raise ConfFileSyntaxError("There are loop in include relationship, at '{}'.".format(path))
+    _including.add(path)
+    try:
+        graph = Graph.from_file(path, included=True)
+    finally:
+        _including.discard(path)
+    _included_graphs[path] = (_mtimes([path] + graph.sources), graph)
+    return graph
+
+
+def _mtimes(paths):
+    """ Dict mapping path to modify time, None if the file is missing. """
+    mtimes = {}
+    for path in paths:
+        try:
+            mtimes[path] = os.path.getmtime(path)
+        except OSError:
+            mtimes[path] = None
+    return mtimes
 
-    def __str__(self):
-        return self.control_script
+
+def body_digest(body):
+    """ Short digest of the job body, used as the script file name. """
+    return hashlib.sha1(body.encode('utf-8')).hexdigest()[:16]
+
+
+def job_digest(js_dict, defaults=""):
+    """
+    Digest of a job's json dict and the serialized graph defaults it's built with,
+    the key of the job cache.
+    """
+    content = defaults + "\0" + json.dumps(js_dict, sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def shell_quote(s):
+    """ Quote a string for using it in shell as one word. """
+    return "'" + s.replace("'", "'\"'\"'") + "'"
+
+
+_worker_job_kwargs = {}
+
+def _init_worker(job_kwargs):
+    """ Store the job kwargs shared by all chunks in worker process. """
+    global _worker_job_kwargs
+    _worker_job_kwargs = job_kwargs
+
+
+def _build_chunk(job_dicts):
+    """
+    Build a chunk of jobs in worker process,
+    return a list of (ok, record or (job id, error message)).
+    """
+    results = []
+    for js_dict in job_dicts:
+        try:
+            job = Job(js_dict, **_worker_job_kwargs)
+            results.append((True, job.record))
+        except Exception as e:
+            job_id = upper_dict_key(js_dict).get('ID')
+            results.append((False, (job_id, "{}: {}".format(type(e).__name__, e))))
+    return results
+
+
+def build_jobs_parallel(job_dicts, job_kwargs, processes, chunksize=1000):
+    """
+    Build Job objects from json dicts in a process pool.
+
+    Job dicts are split to chunks, workers return compact job records,
+    results are merged in the original order.
+    Raise JobBuildError with the failed job ids if any job is invalid.
+
+    """
+    chunks = [job_dicts[i:i+chunksize] for i in range(0, len(job_dicts), chunksize)]
+    pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(job_kwargs,))
+    try:
+        results = pool.map(_build_chunk, chunks)
+    finally:
+        pool.close()
+        pool.join()
+
+    jobs = []
+    errors = []
+    for chunk in results:
+        for ok, res in chunk:
+            if ok:
+                jobs.append(Job.from_record(res))
+            else:
+                errors.append(res)
+    if errors:
+        raise JobBuildError(errors)
+    return jobs
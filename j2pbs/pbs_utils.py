@@ -1,5 +1,7 @@
 import subprocess
 
+from .exceptions import CommandError
+
 def here_doc(content):
     """ construct bash here doc. """
     here_doc = "<<'EOF'\n{}\nEOF\n".format(content)
@@ -16,3 +18,19 @@ def run_bash(filename):
     """ run bash script. """
     cmd = "cat {} | bash".format(filename)
     subp = subprocess.call(cmd, shell=True)
+
+
+def run_command(argv, input=None):
+    """
+    run command with arguments list, return it's stdout string,
+    raise CommandError if it exits with non-zero status.
+    """
+    subp = subprocess.Popen(argv,
+            stdin=subprocess.PIPE if input is not None else None,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True)
+    out, err = subp.communicate(input)
+    if subp.returncode != 0:
+        raise CommandError(argv, subp.returncode, out, err)
+    return out
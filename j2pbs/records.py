@@ -0,0 +1,33 @@
+"""
+records
+~~~~~~~
+Records of submitted jobs, map job names to scheduler job ids,
+used to manage the jobs of a graph after submitted, like cancel them.
+
+The record file is a text file, each line is "<job name>\\t<scheduler job id>",
+lines are appended when jobs are submitted,
+if a job is submitted several times, the last line wins.
+
+"""
+
+
+def default_record_path(json_path):
+    """ The default record file of a json config file. """
+    return json_path + ".ids"
+
+
+def append_record(path, name, id_):
+    """ Append a submitted job to the record file. """
+    with open(path, 'a') as f:
+        f.write("{}\t{}\n".format(name, id_))
+
+
+def read_record(path):
+    """ Read the record file, return a dict mapping job name to scheduler job id. """
+    name2id = {}
+    with open(path) as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) == 2 and fields[1]:
+                name2id[fields[0]] = fields[1]
+    return name2id
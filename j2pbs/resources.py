@@ -0,0 +1,156 @@
+import os
+import re
+
+from .exceptions import InvalidResources
+
+"""
+resources
+~~~~~~~~~
+Layered job resources and their validation.
+
+Resources are merged key by key, from low priority to high:
+
+    module defaults < graph "resources" < profile or auto-sizing rule < job "resources"
+
+A job uses either it's "profile", or the auto-sizing rule if it has no profile,
+the two layers are never stacked.
+
+Profiles are named resources defined in the graph:
+
+    "profiles": {"small": {"ppn": 1, "mem": "2gb"}, "bigmem": {"ppn": 4, "mem": "64gb"}}
+
+Auto-sizing chooses resources by the size of a variable,
+the size of the file it refers to, or the size it writes, like "10gb":
+
+    "autosize": {
+        "var": "input",
+        "rules": [
+            {"max": "1gb", "profile": "small"},
+            {"max": "20gb", "resources": {"mem": "16gb"}},
+            {"profile": "bigmem"}
+        ]
+    }
+
+The first rule which `max` is not less than the size wins,
+a rule without `max` matches any size.
+
+"""
+
+SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+MEMORY_KEYS = ('mem', 'pmem', 'vmem', 'pvmem')
+
+
+def merge_resources(*layers):
+    """ Merge resources dicts key by key, later layers have higher priority. """
+    merged = {}
+    for layer in layers:
+        if not layer:
+            continue
+        if type(layer) is not dict:
+            raise InvalidResources("Resources must be a object/dict.")
+        merged.update(layer)
+    return merged
+
+
+def parse_size(size):
+    """ Parse size like "10gb", "512mb" or number of bytes to bytes. """
+    if isinstance(size, (int, float)):
+        return size
+    m = re.match(r"^\s*(\d+(?:\.\d+)?)\s*([kmgt]?)b?\s*$", str(size).lower())
+    if not m:
+        raise InvalidResources("Invalid size '{}'.".format(size))
+    return float(m.group(1)) * SIZE_UNITS[m.group(2)]
+
+
+def parse_walltime(walltime):
+    """
+    Parse walltime like "[[DD:]HH:]MM:SS" or seconds number to seconds.
+    """
+    if isinstance(walltime, (int, float)):
+        return float(walltime)
+    try:
+        parts = [float(p) for p in str(walltime).strip().split(":")]
+    except ValueError:
+        raise InvalidResources("Invalid walltime '{}'.".format(walltime))
+    if not 1 <= len(parts) <= 4:
+        raise InvalidResources("Invalid walltime '{}'.".format(walltime))
+    seconds = 0.0
+    for p, unit in zip(reversed(parts), (1, 60, 3600, 86400)):
+        seconds += p * unit
+    return seconds
+
+
+def value_size(value):
+    """
+    Size of a variable value: the file size if it's a path, or the size it writes,
+    None if it's neither, like a file made by upstream jobs or on another host.
+    """
+    if isinstance(value, str) and os.path.isfile(value):
+        return os.path.getsize(value)
+    try:
+        return parse_size(value)
+    except InvalidResources:
+        return None
+
+
+def autosize_resources(autosize, scope, profiles):
+    """
+    Choose resources by auto-sizing rules.
+
+    :autosize: the auto-sizing config, see the module document.
+    :scope: variables of the job.
+    :profiles: profiles defined in graph.
+
+    return the resources of the matched rule, or None if no rule matched,
+    the variable not defined for the job, or it's size unknown.
+    Raise InvalidResources if a rule's `max` is not a size.
+
+    """
+    rules = autosize.get('rules', [])
+    maxes = [parse_size(rule['max']) if 'max' in rule else None for rule in rules]
+    var = autosize.get('var')
+    if var not in scope:
+        return None
+    size = value_size(scope[var])
+    if size is None:
+        return None
+    for rule, max_ in zip(rules, maxes):
+        if (max_ is not None) and (size > max_):
+            continue
+        resources = {}
+        if 'profile' in rule:
+            resources.update(get_profile(profiles, rule['profile']))
+        resources.update(rule.get('resources', {}))
+        return resources
+    return None
+
+
+def get_profile(profiles, name):
+    if name not in profiles:
+        raise InvalidResources("Resources profile '{}' not defined.".format(name))
+    return profiles[name]
+
+
+def validate_resources(resources):
+    """ Check the resources request, raise InvalidResources if invalid. """
+    for k, v in resources.items():
+        if v is None or v == "":
+            raise InvalidResources("Resource '{}' has no value.".format(k))
+
+    if ('ppn' in resources) and ('nodes' not in resources):
+        raise InvalidResources("Resources can't only contain ppn without nodes")
+    if 'nodes' in resources:
+        nodes = resources['nodes']
+        if isinstance(nodes, (int, float)) or str(nodes).isdigit():
+            if int(nodes) < 1 or int(nodes) != float(nodes):
+                raise InvalidResources("nodes must be a positive integer, not '{}'.".format(nodes))
+    if 'ppn' in resources:
+        ppn = resources['ppn']
+        if not str(ppn).isdigit() or int(ppn) < 1:
+            raise InvalidResources("ppn must be a positive integer, not '{}'.".format(ppn))
+    for k in MEMORY_KEYS:
+        if k in resources:
+            parse_size(resources[k])
+    if 'walltime' in resources:
+        if parse_walltime(resources['walltime']) <= 0:
+            raise InvalidResources("walltime must be positive.")
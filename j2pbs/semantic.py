@@ -1,6 +1,8 @@
-from .exceptions import VariableKeyError
+import re
 
-def var_sub(args, scope, var_sign='$', escape='^'):
+from .exceptions import VariableKeyError, VariableLoopReference
+
+def var_sub(args, scope, var_sign='$', escape='^', strict=True, escape_any=True):
     """
     Variable substitution, 
     substitute args's variable token with variables in scope.
@@ -9,14 +11,20 @@ def var_sub(args, scope, var_sign='$', escape='^'):
     :scope: variables used to subsititute command. [self.scope]
     :var_sign: the start char of a variable. ['$']
     :escape: the escape char. ['^']
+    :strict: raise VariableKeyError when variable not found,
+             otherwise keep the token as it is. [True]
+    :escape_any: the escape char is removed ahead of any token,
+                 otherwise only ahead of a variable, like "^$HOME". [True]
 
     """
     def sub(token):
-        if token.startswith(escape):
+        if token.startswith(escape) and (escape_any or token[1:].startswith(var_sign)):
             subed = token[1:]
         elif token.startswith(var_sign): # this argument is a variable
             var_key = token[1:]
             if var_key not in scope:
+                if not strict:
+                    return token
                 raise VariableKeyError("Variable '{}' not found.".format(var_key))
             subed = scope[var_key]
         else:
@@ -35,3 +43,86 @@ def var_sub(args, scope, var_sign='$', escape='^'):
         else:
             subed_args.append(sub(arg))
     return subed_args
+
+
+# shell words of a value: runs of unquoted chars, 'single' or "double" quoted strings
+_WORD = re.compile(r"""(?:[^\s'"]+|'[^']*'|"[^"]*")+""")
+
+
+class _LazyScope(object):
+    """
+    A read only mapping view used by `resolve_scope`,
+    variables are resolved when they are first looked up.
+    A variable referencing itself means the one of the outer scope,
+    like "opts": "$opts -v" extends the global "opts".
+    """
+    def __init__(self, resolve, variables, outer_scope, self_key=None):
+        self.resolve = resolve
+        self.variables = variables
+        self.outer_scope = outer_scope
+        self.self_key = self_key
+
+    def __contains__(self, key):
+        if key == self.self_key:
+            return key in self.outer_scope
+        return (key in self.variables) or (key in self.outer_scope)
+
+    def __getitem__(self, key):
+        if key in self.variables and key != self.self_key:
+            return self.resolve(key)
+        return self.outer_scope[key]
+
+
+def resolve_scope(variables, outer_scope={}, var_sign='$', escape='^'):
+    """
+    Resolve variable references within variables's values.
+
+    Values may reference other variables in the same dict or
+    variables in the outer scope (global or shell variables).
+    Every variable is resolved only once, in the dependent order,
+    references which can not be found are kept as it is,
+    so they can still be expanded by shell when the job runs.
+
+    References are substituted inside the original value,
+    so it's quoting and spacing are kept, words in single quotes are not substituted.
+
+    :variables: dict of variables to be resolved.
+    :outer_scope: variables of lower priority. [{}]
+
+    return a new dict mapping variable names to resolved values,
+    raise VariableLoopReference if there are loop in references.
+
+    """
+    resolved = {}
+    resolving = set()
+
+    def sub_word(word, scope):
+        if "'" in word:
+            return word
+        if word.startswith('"') and word.endswith('"') and len(word) > 1:
+            return '"' + sub_word(word[1:-1], scope) + '"'
+        if '"' in word:
+            return word
+        subed = var_sub([word], scope, var_sign=var_sign, escape=escape,
+                        strict=False, escape_any=False)[0]
+        return str(subed)
+
+    def resolve(key):
+        if key in resolved: # memoized
+            return resolved[key]
+        if key in resolving:
+            raise VariableLoopReference(key)
+        value = variables[key]
+        if type(value) not in (str, type(u"")) or (var_sign not in value):
+            resolved[key] = value
+            return value
+        resolving.add(key)
+        scope = _LazyScope(resolve, variables, outer_scope, self_key=key)
+        value = _WORD.sub(lambda m: sub_word(m.group(0), scope), value)
+        resolving.discard(key)
+        resolved[key] = value
+        return value
+
+    for key in variables:
+        resolve(key)
+    return resolved
@@ -0,0 +1,232 @@
+import heapq
+
+from .exceptions import InvalidResources
+from .resources import parse_walltime
+
+"""
+simulate
+~~~~~~~~
+Dry-run discrete-event simulation of a Graph on a cluster,
+estimate the makespan and queue load before submitting.
+
+Each job occupies `nodes * ppn` cores for it's `walltime`,
+jobs start as soon as their dependences finished and there are enough free cores.
+An array job runs as one task per index, each task occupies the cores of the job,
+at most `%limit` tasks at the same time if specified, the job is finished
+when all it's tasks finished.
+Ready jobs are started in priority order without backfilling:
+
+    | fifo:     the order of jobs in the config file (topological order)
+    | critical: the job with longest remaining path first
+
+>>> res = simulate(graph, cores=256)
+>>> print(res.report())
+
+"""
+
+ORDERS = ('fifo', 'critical')
+
+
+def job_cores(resources):
+    """ Number of cores required by resources: nodes * ppn. """
+    nodes = resources.get('nodes', 1)
+    try:
+        nodes = int(nodes)
+    except ValueError:
+        nodes = len(str(nodes).split("+")) # node names like "node1+node2"
+    try:
+        ppn = int(resources.get('ppn', 1))
+    except ValueError:
+        raise InvalidResources("Invalid ppn '{}'.".format(resources.get('ppn')))
+    return nodes * ppn
+
+
+def array_tasks(array):
+    """
+    Number of tasks and the max running tasks(None if no limit) of
+    an array index range like "1-10", "1,3,5-9:2" or "1-100%10".
+    """
+    if not array:
+        return 1, None
+    array = str(array).replace(" ", "")
+    limit = None
+    if "%" in array:
+        array, limit = array.split("%", 1)
+    try:
+        if limit is not None:
+            limit = int(limit)
+            if limit < 1:
+                raise ValueError
+        n = 0
+        for part in array.split(","):
+            step = 1
+            if ":" in part:
+                part, step = part.split(":", 1)
+                step = int(step)
+            if "-" in part:
+                start, end = part.split("-", 1)
+                start, end = int(start), int(end)
+            else:
+                start = end = int(part)
+            if step < 1 or end < start:
+                raise ValueError
+            n += (end - start) // step + 1
+    except ValueError:
+        raise InvalidResources("Invalid array index range '{}'.".format(array))
+    return n, limit
+
+
+class SimulationResult(object):
+    """ The statistics of one simulation. """
+
+    def __init__(self, cores, makespan, critical_path, critical_path_length,
+                 peak_running, peak_running_cores, peak_waiting, core_hours):
+        self.cores = cores
+        self.makespan = makespan                  # seconds
+        self.critical_path = critical_path        # list of jobs
+        self.critical_path_length = critical_path_length # seconds
+        self.peak_running = peak_running          # jobs(array tasks) running at the same time
+        self.peak_running_cores = peak_running_cores
+        self.peak_waiting = peak_waiting          # jobs ready but waiting for cores
+        self.core_hours = core_hours
+
+    @property
+    def utilization(self):
+        if self.makespan == 0:
+            return 0.0
+        return self.core_hours * 3600 / (self.cores * self.makespan)
+
+    def report(self):
+        """ Human readable report string. """
+        def hms(seconds):
+            seconds = int(round(seconds))
+            return "{:d}:{:02d}:{:02d}".format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+        lines = [
+            "cluster cores:        {}".format(self.cores),
+            "makespan:             {}".format(hms(self.makespan)),
+            "critical path:        {} ({} jobs)".format(
+                hms(self.critical_path_length), len(self.critical_path)),
+            "                      {}".format(" -> ".join(j.name for j in self.critical_path)),
+            "peak running jobs:    {} ({} cores)".format(self.peak_running, self.peak_running_cores),
+            "peak waiting jobs:    {}".format(self.peak_waiting),
+            "core hours:           {:.2f}".format(self.core_hours),
+            "utilization:          {:.1%}".format(self.utilization),
+        ]
+        return "\n".join(lines)
+
+
+def simulate(graph, cores, default_walltime=3600, order='fifo'):
+    """
+    Simulate running graph on a cluster.
+
+    :graph: the Graph to be simulated.
+    :cores: the number of cores of the cluster.
+    :default_walltime: walltime of jobs not specify it. [1 hour]
+    :order: priority of ready jobs, 'fifo' or 'critical'. ['fifo']
+
+    return a SimulationResult.
+
+    """
+    if order not in ORDERS:
+        raise ValueError("order must be one of: " + ", ".join(ORDERS))
+
+    jobs = graph.topological_order()
+    job2index = {job: i for i, job in enumerate(jobs)}
+    n = len(jobs)
+    duration = []
+    need = []
+    tasks = []  # number of array tasks, 1 for normal jobs
+    limit = []  # max running tasks
+    for job in jobs:
+        n_tasks, max_tasks = array_tasks(job.array)
+        tasks.append(n_tasks)
+        limit.append(max_tasks or n_tasks)
+        duration.append(parse_walltime(job.resources.get('walltime', default_walltime)))
+        c = job_cores(job.resources)
+        if c > cores:
+            raise InvalidResources("Job '{}' requires {} cores, more than the cluster's {}.".format(
+                job.name, c, cores))
+        need.append(c)
+    parents = [[job2index[j] for j in graph.dependent[job]] for job in jobs]
+    children = [[] for _ in range(n)]
+    for i in range(n):
+        for p in parents[i]:
+            children[p].append(i)
+
+    # at least the walltime, or several rounds of it if the running tasks are limited
+    span = [d * -(-t // l) for d, t, l in zip(duration, tasks, limit)]
+
+    # critical path: longest path weighted by span
+    finish = [0.0] * n
+    prev = [None] * n
+    for i in range(n):
+        start = 0.0
+        for p in parents[i]:
+            if finish[p] > start:
+                start, prev[i] = finish[p], p
+        finish[i] = start + span[i]
+    path = []
+    if n:
+        i = max(range(n), key=lambda k: finish[k])
+        critical_path_length = finish[i]
+        while i is not None:
+            path.append(jobs[i])
+            i = prev[i]
+        path.reverse()
+    else:
+        critical_path_length = 0.0
+
+    # priority of ready jobs, smaller first
+    if order == 'critical':
+        rest = [0.0] * n # longest path from job to the end
+        for i in reversed(range(n)):
+            rest[i] = span[i] + max([rest[c] for c in children[i]] or [0.0])
+        priority = [-r for r in rest]
+    else:
+        priority = list(range(n))
+
+    # event loop, a ready array job stays at the head of ready jobs
+    # until all it's tasks started, or it's running tasks reach the limit.
+    n_depend = [len(parents[i]) for i in range(n)]
+    pending = list(tasks)   # tasks not started
+    unfinished = list(tasks)
+    n_running = [0] * n
+    ready = [(priority[i], i) for i in range(n) if n_depend[i] == 0]
+    heapq.heapify(ready)
+    running = [] # (end time, job index)
+    free = cores
+    now = 0.0
+    peak_running = peak_running_cores = peak_waiting = 0
+    while ready or running:
+        while ready and need[ready[0][1]] <= free:
+            i = ready[0][1]
+            free -= need[i]
+            pending[i] -= 1
+            n_running[i] += 1
+            if pending[i] == 0 or n_running[i] == limit[i]:
+                heapq.heappop(ready)
+            heapq.heappush(running, (now + duration[i], i))
+        peak_running = max(peak_running, len(running))
+        peak_running_cores = max(peak_running_cores, cores - free)
+        peak_waiting = max(peak_waiting, len(ready))
+
+        now, i = heapq.heappop(running)
+        finished = [i]
+        while running and running[0][0] == now:
+            finished.append(heapq.heappop(running)[1])
+        for i in finished:
+            free += need[i]
+            n_running[i] -= 1
+            unfinished[i] -= 1
+            if pending[i] > 0 and n_running[i] == limit[i] - 1: # was held by the limit
+                heapq.heappush(ready, (priority[i], i))
+            if unfinished[i] > 0:
+                continue
+            for c in children[i]:
+                n_depend[c] -= 1
+                if n_depend[c] == 0:
+                    heapq.heappush(ready, (priority[c], c))
+
+    core_hours = sum(d * c * t for d, c, t in zip(duration, need, tasks)) / 3600.0
+    return SimulationResult(cores, now, path, critical_path_length,
+                            peak_running, peak_running_cores, peak_waiting, core_hours)
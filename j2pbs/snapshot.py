@@ -0,0 +1,299 @@
+import os
+import gc
+import json
+import mmap
+import struct
+
+from .model import Job, Graph
+from .exceptions import SnapshotFormatError
+
+"""
+snapshot
+~~~~~~~~
+Binary snapshot of a built Graph, for reload it fast without
+parsing json and variable substitution again.
+
+File layout (all integers are little endian uint32):
+
+    header:      magic(4s) version(H) reserved(H)
+                 n_jobs n_strings n_cmds n_edges name_index backend_index
+    string table: offsets[n_strings + 1], utf-8 data
+    job table:   n_jobs * (id name dir queue resources array cmd_start cmd_count)
+                 all fields except cmd_start/cmd_count are string indexes,
+                 id, resources and array are stored as json text.
+    commands:    string indexes[n_cmds]
+    dependent:   offsets[n_jobs + 1], job indexes[n_edges],
+                 dependent types[n_edges] (string indexes)
+
+Save and load:
+>>> dump(graph, "graph.j2g")
+>>> snap = load("graph.j2g")
+>>> snap.job_name(0)
+>>> graph = snap.to_graph()
+
+"""
+
+MAGIC = b"J2PB"
+VERSION = 3
+
+_HEADER = struct.Struct("<4sHHIIIIII")
+_JOB = struct.Struct("<8I")
+_UINT = struct.Struct("<I")
+
+
+def dumps(graph):
+    """ Serialize a built Graph to snapshot bytes. """
+    strings = []
+    str2index = {}
+
+    def intern(s):
+        if s not in str2index:
+            str2index[s] = len(strings)
+            strings.append(s)
+        return str2index[s]
+
+    name_index = intern(graph.name)
+    backend_index = intern(graph.backend.name)
+    job2index = {job: i for i, job in enumerate(graph.jobs)}
+
+    job_table = []
+    cmds = []
+    dep_offsets = [0]
+    deps = []
+    dep_types = []
+    for job in graph.jobs:
+        job_table.append(_JOB.pack(
+            intern(json.dumps(job.id)),
+            intern(job.name),
+            intern(job.dir),
+            intern(job.queue or ""), # not set
+            intern(json.dumps(job.resources, sort_keys=True)),
+            intern(json.dumps(job.array)),
+            len(cmds),
+            len(job.commands)))
+        cmds.extend(intern(cmd) for cmd in job.commands)
+        deps.extend(job2index[j] for j in graph.dependent[job])
+        dep_types.extend(intern(graph.depend_type(job, j)) for j in graph.dependent[job])
+        dep_offsets.append(len(deps))
+
+    encoded = [s.encode('utf-8') for s in strings]
+    str_offsets = [0]
+    for b in encoded:
+        str_offsets.append(str_offsets[-1] + len(b))
+
+    def uints(values):
+        return struct.pack("<{}I".format(len(values)), *values)
+
+    header = _HEADER.pack(MAGIC, VERSION, 0,
+            len(graph.jobs), len(strings), len(cmds), len(deps),
+            name_index, backend_index)
+    return b"".join([
+        header,
+        uints(str_offsets),
+        b"".join(encoded),
+        b"".join(job_table),
+        uints(cmds),
+        uints(dep_offsets),
+        uints(deps),
+        uints(dep_types),
+    ])
+
+
+def dump(graph, path):
+    """ Write the snapshot of a built Graph to file. """
+    with open(path, 'wb') as f:
+        f.write(dumps(graph))
+
+
+def load(path):
+    """ Open a snapshot file with mmap, return a GraphSnapshot. """
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size < _HEADER.size: # mmap can't map an empty file
+            raise SnapshotFormatError("file too short")
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return GraphSnapshot(buf)
+
+
+def is_snapshot(path):
+    """ Whether the file is a snapshot, by it's magic number. """
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+class GraphSnapshot(object):
+    """
+    Read only view of a snapshot buffer.
+    Fields are decoded from the buffer on access, nothing is copied in advance.
+    """
+
+    def __init__(self, buf):
+        self.buf = buf
+        if len(buf) < _HEADER.size:
+            raise SnapshotFormatError("file too short")
+        (magic, version, _,
+         self.n_jobs, self.n_strings, self.n_cmds, self.n_edges,
+         self._name_index, self._backend_index) = _HEADER.unpack_from(buf, 0)
+        if magic != MAGIC:
+            raise SnapshotFormatError("bad magic number")
+        if version != VERSION:
+            raise SnapshotFormatError("unsupported version {}".format(version))
+
+        # compute section offsets
+        self._str_offsets = _HEADER.size
+        self._str_data = self._str_offsets + (self.n_strings + 1) * _UINT.size
+        str_data_size = self._uint(self._str_offsets, self.n_strings)
+        self._job_table = self._str_data + str_data_size
+        self._cmds = self._job_table + self.n_jobs * _JOB.size
+        self._dep_offsets = self._cmds + self.n_cmds * _UINT.size
+        self._deps = self._dep_offsets + (self.n_jobs + 1) * _UINT.size
+        self._dep_types = self._deps + self.n_edges * _UINT.size
+        if len(buf) < self._dep_types + self.n_edges * _UINT.size:
+            raise SnapshotFormatError("file truncated")
+
+    def _uints(self, section, count):
+        return struct.unpack_from("<{}I".format(count), self.buf, section)
+
+    def _uint(self, section, i):
+        return _UINT.unpack_from(self.buf, section + i * _UINT.size)[0]
+
+    def string(self, i):
+        start = self._uint(self._str_offsets, i)
+        end = self._uint(self._str_offsets, i + 1)
+        return self.buf[self._str_data + start:self._str_data + end].decode('utf-8')
+
+    def _job_fields(self, i):
+        return _JOB.unpack_from(self.buf, self._job_table + i * _JOB.size)
+
+    @property
+    def name(self):
+        return self.string(self._name_index)
+
+    @property
+    def backend(self):
+        return self.string(self._backend_index)
+
+    def __len__(self):
+        return self.n_jobs
+
+    def job_id(self, i):
+        return json.loads(self.string(self._job_fields(i)[0]))
+
+    def job_name(self, i):
+        return self.string(self._job_fields(i)[1])
+
+    def job_commands(self, i):
+        fields = self._job_fields(i)
+        start, count = fields[6], fields[7]
+        return [self.string(self._uint(self._cmds, start + k)) for k in range(count)]
+
+    def job_dependent(self, i):
+        """ Indexes of the jobs which job i depend on. """
+        start = self._uint(self._dep_offsets, i)
+        end = self._uint(self._dep_offsets, i + 1)
+        return [self._uint(self._deps, k) for k in range(start, end)]
+
+    def job_depend_types(self, i):
+        """ Dependent types of the edges returned by `job_dependent`. """
+        start = self._uint(self._dep_offsets, i)
+        end = self._uint(self._dep_offsets, i + 1)
+        return [self.string(self._uint(self._dep_types, k)) for k in range(start, end)]
+
+    def job(self, i, ids=None):
+        """
+        Restore the Job object at index i.
+
+        :ids: list of all job ids, avoid decoding them repeatedly. [None]
+
+        """
+        id_, name, dir_, queue, resources, array, _, _ = self._job_fields(i)
+        if ids is None:
+            dependent = [self.job_id(k) for k in self.job_dependent(i)]
+        else:
+            dependent = [ids[k] for k in self.job_dependent(i)]
+        depend_types = {}
+        for dep_id, type_ in zip(dependent, self.job_depend_types(i)):
+            if type_ != 'afterok':
+                depend_types[dep_id] = type_
+        record = (
+            json.loads(self.string(id_)),
+            self.string(name),
+            self.string(dir_),
+            self.string(queue) or None,
+            self.job_commands(i),
+            json.loads(self.string(resources)),
+            dependent,
+            json.loads(self.string(array)),
+            depend_types,
+        )
+        return Job.from_record(record)
+
+    def to_graph(self, backend=None):
+        """
+        Restore the Graph object, sections are decoded in bulk.
+
+        :backend: override the scheduler backend saved in snapshot. [None]
+
+        """
+        # millions of small containers are created and none of them is garbage,
+        # the cyclic collector would scan them again and again
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return self._to_graph(backend)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _to_graph(self, backend):
+        n_jobs = self.n_jobs
+        str_offsets = self._uints(self._str_offsets, self.n_strings + 1)
+        data = self.buf[self._str_data:self._str_data + str_offsets[-1]]
+        text = data.decode('utf-8')
+        if len(text) != len(data): # not ascii, byte offsets can't index the text
+            strings = [data[str_offsets[i]:str_offsets[i + 1]].decode('utf-8')
+                       for i in range(self.n_strings)]
+        else:
+            strings = [text[str_offsets[i]:str_offsets[i + 1]] for i in range(self.n_strings)]
+        loaded = {} # string index -> decoded json, resources are shared by many jobs
+
+        def load_json(i):
+            if i not in loaded:
+                loaded[i] = json.loads(strings[i])
+            return loaded[i]
+
+        fields = self._uints(self._job_table, n_jobs * 8)
+        cmds = self._uints(self._cmds, self.n_cmds)
+        dep_offsets = self._uints(self._dep_offsets, n_jobs + 1)
+        deps = self._uints(self._deps, self.n_edges)
+        dep_types = self._uints(self._dep_types, self.n_edges)
+
+        # ids are json texts, decode them as one json array
+        ids = json.loads("[" + ",".join([strings[k] for k in fields[0::8]]) + "]")
+        jobs = []
+        job_deps = []
+        for i in range(n_jobs):
+            id_, name, dir_, queue, resources, array, cmd_start, cmd_count = fields[i*8:i*8+8]
+            start, end = dep_offsets[i], dep_offsets[i + 1]
+            job_deps.append(deps[start:end])
+            dependent = [ids[k] for k in job_deps[-1]]
+            depend_types = {}
+            for dep_id, type_ in zip(dependent, dep_types[start:end]):
+                if strings[type_] != 'afterok':
+                    depend_types[dep_id] = strings[type_]
+            jobs.append(Job.from_record((
+                ids[i],
+                strings[name],
+                strings[dir_],
+                strings[queue] or None,
+                [strings[k] for k in cmds[cmd_start:cmd_start + cmd_count]],
+                dict(load_json(resources)), # copy, jobs may change their own resources
+                dependent,
+                load_json(array),
+                depend_types,
+            )))
+        dependent = {job: [jobs[k] for k in job_deps[i]] for i, job in enumerate(jobs)}
+        return Graph.from_jobs(self.name, jobs, backend=backend or self.backend,
+                               dependent=dependent)
+
+    def close(self):
+        self.buf.close()
@@ -0,0 +1,219 @@
+from __future__ import print_function
+
+import sys
+import time
+
+from .pbs_utils import run_command
+from .backends import DONE
+from .exceptions import SubmitError
+from .metrics import REGISTRY as metrics
+from .records import append_record
+
+"""
+submitter
+~~~~~~~~~
+Submit the jobs of a Graph from python, instead of running the control script.
+Support throttling: keep at most N jobs of the graph queued or running,
+release new submissions when earlier ones finished.
+
+>>> s = Submitter(graph, max_inflight=500)
+>>> ids = s.submit_all()  # dict mapping Job to scheduler job id
+
+"""
+
+
+class Submitter(object):
+    """
+    Submit jobs in the topological order of the graph.
+
+    :graph: the Graph to be submitted.
+    :max_inflight: the max number of jobs queued or running at the same time,
+                   no limit if None. [None]
+    :poll_interval: seconds to wait between two status polls,
+                    when the in-flight window is full. [30]
+    :poll_batch: the max number of job ids query in one status command. [500]
+    :run: function for run a command: run(argv, input=None) -> stdout
+    :sleep: function for sleep, replaceable for tests.
+    :out: file to echo the submitted job ids, like the control script. [None]
+    :retries: times to retry a failed submit command. [2]
+    :retry_wait: seconds to wait before retry. [5]
+    :record: append submitted job names and ids to this file, see `j2pbs.records`. [None]
+
+    The scheduler may not know jobs which already left the queue,
+    so dependences on them are checked here with their exit states
+    from the scheduler accounting (see `Backend.parse_accounting`):
+    satisfied ones are dropped, and jobs whose dependences can never be
+    satisfied (like 'afterok' on a failed job) are skipped, so are their
+    'afterok' descendants. If the exit state is unknown, the dependence
+    is still passed to the scheduler. Submitted jobs whose dependences
+    turn out never to be satisfied are counted as failed, so they don't
+    hold the in-flight window.
+
+    """
+
+    def __init__(self, graph,
+                 max_inflight=None,
+                 poll_interval=30,
+                 poll_batch=500,
+                 run=run_command,
+                 sleep=time.sleep,
+                 out=None,
+                 retries=2,
+                 retry_wait=5,
+                 record=None):
+        if max_inflight is not None and max_inflight < 1:
+            raise ValueError("max_inflight must be a positive number.")
+        self.graph = graph
+        self.backend = graph.backend
+        self.max_inflight = max_inflight
+        self.poll_interval = poll_interval
+        self.poll_batch = poll_batch
+        self.run = run
+        self.sleep = sleep
+        self.out = out
+        self.retries = retries
+        self.retry_wait = retry_wait
+        self.record = record
+
+        self.ids = {}          # Job -> scheduler job id
+        self.inflight = {}     # scheduler job id -> Job, jobs queued or running
+        self.finished = {}     # Job -> exited normally or not, None if unknown
+        self.skipped = []      # jobs not submitted, their dependences can't be satisfied
+
+    def depends(self, job):
+        """
+        Return the (dependent type, job id) pairs passed to the scheduler,
+        or None if the dependences of job can never be satisfied.
+        A skipped job counts as failed.
+        """
+        depends = []
+        for j in self.graph.dependent[job]:
+            type_ = self.graph.depend_type(job, j)
+            if j in self.finished:
+                ok = self.finished[j]
+            elif j in self.ids: # in flight
+                ok = None
+            else: # skipped
+                ok = False
+            if ok is None:
+                depends.append((type_, self.ids[j]))
+            elif type_ == 'afternotok' and ok:
+                return None
+            elif type_ in ('afterok', 'afterokarray') and not ok:
+                return None
+        return depends
+
+    def drop_unsatisfiable(self):
+        """
+        Move in-flight jobs whose dependences can never be satisfied
+        to `self.finished` as failed. The scheduler keeps them pending
+        (Slurm shows the reason 'DependencyNeverSatisfied'),
+        they would hold the window forever.
+        """
+        changed = True
+        while changed:
+            changed = False
+            for id_, job in list(self.inflight.items()):
+                if any(j in self.finished for j in self.graph.dependent[job]) \
+                        and self.depends(job) is None:
+                    del self.inflight[id_]
+                    self.finished[job] = False
+                    changed = True
+
+    def submit(self, job):
+        """ Submit one job, return the scheduler job id, or None if it's skipped. """
+        depends = self.depends(job)
+        if depends is None:
+            self.skipped.append(job)
+            metrics.inc('j2pbs_skipped_jobs_total', backend=self.backend.name)
+            return None
+        argv = self.backend.submit_argv(depends=depends)
+        script = job.render(self.backend)
+        metrics.inc('j2pbs_rendered_bytes_total', len(script))
+        labels = {'backend': self.backend.name}
+        for n_try in range(self.retries + 1):
+            if n_try > 0:
+                metrics.inc('j2pbs_submit_retries_total', **labels)
+                self.sleep(self.retry_wait)
+            start_time = time.time()
+            try:
+                output = self.run(argv, input=script)
+            except OSError:
+                output = None
+            metrics.observe('j2pbs_submit_seconds', time.time() - start_time, **labels)
+            id_ = self.backend.parse_submit_output(output or "")
+            if id_:
+                break
+        else:
+            metrics.inc('j2pbs_submit_failures_total', **labels)
+            raise SubmitError(job.name, " ".join(argv))
+        metrics.inc('j2pbs_submitted_jobs_total', **labels)
+        self.ids[job] = id_
+        self.inflight[id_] = job
+        if self.record is not None:
+            append_record(self.record, job.name, id_)
+        if self.out is not None:
+            print(id_, file=self.out)
+        return id_
+
+    def refresh(self):
+        """
+        Poll the status of in-flight jobs in batches,
+        move finished jobs to `self.finished` with their exit states.
+        If the status command fails, the rest jobs are kept in flight
+        until the next refresh.
+        """
+        ids = list(self.inflight)
+        for i in range(0, len(ids), self.poll_batch):
+            try:
+                states = self.backend.poll(ids[i:i+self.poll_batch], run=self.run)
+            except OSError:
+                metrics.inc('j2pbs_poll_failures_total', backend=self.backend.name)
+                break
+            done = [id_ for id_, state in states.items() if state == DONE]
+            usages = self.accounting(done) if done else {}
+            for id_ in done:
+                usage = usages.get(id_)
+                self.finished[self.inflight.pop(id_)] = usage.ok if usage else None
+        self.drop_unsatisfiable()
+
+    def accounting(self, ids):
+        """ Usages of finished jobs, empty if the backend can't tell. """
+        try:
+            argv = self.backend.accounting_argv(ids)
+            return self.backend.parse_accounting(self.backend.query(argv, self.run) or "")
+        except (NotImplementedError, OSError):
+            return {}
+
+    def wait_window(self):
+        """ Block until there is room in the in-flight window. """
+        if self.max_inflight is None:
+            return
+        while len(self.inflight) >= self.max_inflight:
+            self.refresh()
+            if len(self.inflight) >= self.max_inflight:
+                self.sleep(self.poll_interval)
+
+    def submit_all(self):
+        """
+        Submit all jobs, return a dict mapping Job to scheduler job id,
+        skipped jobs are not in it.
+        """
+        for job in self.graph.topological_order():
+            self.wait_window()
+            self.submit(job)
+        return self.ids
+
+
+def submit_graph(graph, max_inflight=None, poll_interval=30, out=sys.stdout, record=None):
+    """ Submit all jobs of graph, return a dict mapping Job to scheduler job id. """
+    submitter = Submitter(graph,
+            max_inflight=max_inflight,
+            poll_interval=poll_interval,
+            out=out,
+            record=record)
+    ids = submitter.submit_all()
+    for job in submitter.skipped:
+        print("j2pbs: skip '{}', it's dependences can't be satisfied.".format(job.name),
+              file=sys.stderr)
+    return ids
@@ -0,0 +1,21 @@
+import os
+import tempfile
+
+STUBS_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
+def use_stubs():
+    """
+    Put the fake scheduler commands in front of PATH,
+    return the directory which store the fake scheduler state.
+    """
+    stub_dir = tempfile.mkdtemp()
+    os.environ['J2PBS_STUB_DIR'] = stub_dir
+    os.environ['PATH'] = STUBS_PATH + os.pathsep + os.environ['PATH']
+    return stub_dir
+
+
+def read_log(stub_dir):
+    """ Return the command lines called. """
+    with open(os.path.join(stub_dir, "log")) as f:
+        return f.read().splitlines()
@@ -0,0 +1,144 @@
+"""
+Fake scheduler commands for tests,
+state is stored in the directory specified by J2PBS_STUB_DIR:
+
+    | counter: last job id
+    | queue:   lines of "<job id> <state>", jobs still in the queue
+    | log:     lines of called command lines
+    | <job id>.sh: submitted scripts
+    | accounting: lines of "<job id> <exit status> <seconds> <peak memory kb>", finished jobs
+    | down:    if exists, all commands fail like the server is unreachable
+
+Tests can edit the queue file to simulate jobs running or finished.
+Like the real commands, querying unknown job ids prints errors to stderr
+and exits with non-zero status.
+"""
+import os
+import sys
+
+STUB_DIR = os.environ['J2PBS_STUB_DIR']
+
+
+def path(name):
+    return os.path.join(STUB_DIR, name)
+
+
+def read_queue():
+    if not os.path.exists(path("queue")):
+        return []
+    with open(path("queue")) as f:
+        return [line.split() for line in f if line.strip()]
+
+
+def write_queue(queue):
+    with open(path("queue"), 'w') as f:
+        for id_, state in queue:
+            f.write("{} {}\n".format(id_, state))
+
+
+def submit(args, suffix, state):
+    n = 0
+    if os.path.exists(path("counter")):
+        with open(path("counter")) as f:
+            n = int(f.read())
+    n += 1
+    with open(path("counter"), 'w') as f:
+        f.write(str(n))
+    id_ = str(n) + suffix
+    files = [a for a in args if os.path.isfile(a)]
+    if files:
+        with open(files[-1]) as f:
+            script = f.read()
+    else:
+        script = sys.stdin.read()
+    with open(path(id_ + ".sh"), 'w') as f:
+        f.write(script)
+    write_queue(read_queue() + [[id_, state]])
+    print(id_)
+
+
+def status(ids, fmt):
+    found = set()
+    for id_, state in read_queue():
+        if id_ in ids:
+            found.add(id_)
+            print(fmt.format(id_, state))
+    return found
+
+
+def read_accounting():
+    if not os.path.exists(path("accounting")):
+        return []
+    with open(path("accounting")) as f:
+        return [line.split() for line in f if line.strip()]
+
+
+def qstat_full(ids, done_state):
+    found = set()
+    for id_, exit_status, seconds, mem in read_accounting():
+        if id_ in ids:
+            found.add(id_)
+            seconds = int(seconds)
+            print("Job Id: {}".format(id_))
+            print("    job_state = {}".format(done_state))
+            print("    resources_used.mem = {}kb".format(mem))
+            print("    resources_used.walltime = {:02d}:{:02d}:{:02d}".format(
+                seconds // 3600, seconds % 3600 // 60, seconds % 60))
+            print("    exit_status = {}".format(exit_status))
+            print("")
+    return found
+
+
+def sacct(ids):
+    for id_, exit_status, seconds, mem in read_accounting():
+        if id_ in ids:
+            state = "COMPLETED" if exit_status == "0" else "FAILED"
+            print("{}|{}|{}|".format(id_, state, seconds))
+            print("{}.batch|{}|{}|{}K".format(id_, state, seconds, mem))
+
+
+def cancel(ids):
+    queue = read_queue()
+    write_queue([q for q in queue if q[0] not in ids])
+    return set(q[0] for q in queue if q[0] in ids)
+
+
+def unknown_pbs_ids(cmd, ids, found):
+    unknown = [id_ for id_ in ids if not id_.startswith("-") and id_ not in found]
+    for id_ in unknown:
+        sys.stderr.write("{}: Unknown Job Id {}\n".format(cmd, id_))
+    return 153 if unknown else 0
+
+
+def main():
+    cmd, args = sys.argv[1], sys.argv[2:]
+    with open(path("log"), 'a') as f:
+        f.write(" ".join([cmd] + args) + "\n")
+    if os.path.exists(path("down")):
+        sys.stderr.write("{}: cannot connect to server\n".format(cmd))
+        return 1
+    if cmd == "qsub":
+        submit(args, ".stub", "Q")
+    elif cmd == "sbatch":
+        submit(args, "", "PD")
+    elif cmd == "qstat" and "-f" in args:
+        return unknown_pbs_ids(cmd, args, qstat_full(args, "F" if "-x" in args else "C"))
+    elif cmd == "qstat":
+        print("Job ID   Name   User   Time Use S Queue")
+        print("-------- ------ ------ -------- - -----")
+        return unknown_pbs_ids(cmd, args, status(args, "{} job user 0 {} batch"))
+    elif cmd == "squeue":
+        if not status(args[args.index("-j") + 1].split(","), "{} {}"):
+            sys.stderr.write("slurm_load_jobs error: Invalid job id specified\n")
+            return 1
+    elif cmd == "sacct":
+        sacct(args[args.index("-j") + 1].split(","))
+    elif cmd == "qdel":
+        return unknown_pbs_ids(cmd, args, cancel(args))
+    elif cmd == "scancel":
+        cancel(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
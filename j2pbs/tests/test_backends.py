@@ -0,0 +1,175 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import shutil
+import subprocess
+
+from j2pbs.model import Job, Graph
+from j2pbs.backends import get_backend, QUEUED, RUNNING, DONE, Usage
+from j2pbs.exceptions import ConfFileSyntaxError, CommandError
+from j2pbs.tests.stubs import use_stubs, read_log
+
+file_spliter = "*" * 50
+
+if __name__ == "__main__":
+    job_json = """
+    {
+        "id": 0,
+        "name": "test",
+        "dir": "/tmp",
+        "array": "1-10",
+        "resources": {"nodes": 1, "ppn": 4, "mem": "4gb", "walltime": "10:10:10"},
+        "cmd": "echo $PBS_ARRAYID"
+    }
+    """
+    job = Job(json.loads(job_json), cmd_sub=False)
+    for name in ("pbs", "pbspro", "slurm"):
+        print(file_spliter)
+        print(job.render(name))
+    print(file_spliter)
+    slurm_script = job.render("slurm")
+    assert "#SBATCH --ntasks-per-node=4" in slurm_script
+    assert "#SBATCH --mem=4G" in slurm_script
+    assert "#SBATCH --array=1-10" in slurm_script
+    assert "#PBS -t 1-10" in job.pbs_script
+    assert "cd /tmp" in job.render("pbspro")
+    # queue not set, use the scheduler's default
+    assert "--partition" not in slurm_script
+    assert "#PBS -q" not in job.pbs_script
+    job.queue = "long"
+    assert "#SBATCH --partition=long" in job.render("slurm")
+    assert "#PBS -q long" in job.pbs_script
+
+    try:
+        get_backend("lsf")
+        assert False
+    except ConfFileSyntaxError as e:
+        print(str(e))
+
+    # submit argv and dependent syntax
+    slurm = get_backend("slurm")
+    argv = slurm.submit_argv("job2", [("afterok", "1"), ("afterany", "2"), ("afterok", "3")], "job2.sh")
+    assert argv == ['sbatch', '--parsable', '--job-name=job2',
+                    '--dependency=afterok:1:3,afterany:2', 'job2.sh']
+    pbs = get_backend("pbs")
+    argv = pbs.submit_argv("job2", [("afterok", "1.admin"), ("afterok", "3.admin")])
+    assert argv == ['qsub', '-N', 'job2', '-W', 'depend=afterok:1.admin,afterok:3.admin']
+
+    # run control scripts with the fake scheduler commands
+    js_str = """
+    {
+        "name": "test",
+        "jobs":
+        [
+            {"id":0, "name":"test0", "cmd":"sleep 10"},
+            {"id":1, "name":"test1", "cmd":"sleep 10"},
+            {"id":2, "name":"test2", "cmd":"echo hello", "depend":[0, 1]}
+        ]
+    }
+    """
+    stub_dir = use_stubs()
+    try:
+        for name in ("pbs", "slurm"):
+            g = Graph(json.loads(js_str), backend=name)
+            out = subprocess.check_output(["bash", "-c", g.control_script],
+                                          universal_newlines=True)
+            ids = out.split()
+            assert len(ids) == 3
+            log = read_log(stub_dir)
+            print(file_spliter)
+            print("\n".join(log))
+            if name == "pbs":
+                assert log[-1] == "qsub -N test2 -W depend=afterok:{},afterok:{}".format(*ids[:2])
+            else:
+                assert log[-1] == "sbatch --parsable --job-name=test2 --dependency=afterok:{}:{}".format(*ids[:2])
+                with open(os.path.join(stub_dir, ids[2] + ".sh")) as f:
+                    assert "#SBATCH" in f.read()
+
+            # status polling
+            backend = g.backend
+            with open(os.path.join(stub_dir, "queue"), 'w') as f:
+                f.write("{} {}\n".format(ids[1], "R"))
+            states = backend.poll(ids)
+            assert states == {ids[0]: DONE, ids[1]: RUNNING, ids[2]: DONE}
+            # all unknown ids
+            with open(os.path.join(stub_dir, "queue"), 'w') as f:
+                pass
+            assert set(backend.poll(ids).values()) == {DONE}
+            # the status command fails
+            open(os.path.join(stub_dir, "down"), 'w').close()
+            try:
+                backend.poll(ids)
+                assert False
+            except CommandError as e:
+                print(str(e))
+            os.remove(os.path.join(stub_dir, "down"))
+
+        # submit a single job with the selected scheduler
+        job_path = os.path.join(stub_dir, "job.json")
+        with open(job_path, 'w') as f:
+            json.dump({"id": 0, "name": "single", "cmd": "echo hello"}, f)
+        out = subprocess.check_output([sys.executable, "-m", "j2pbs", "--type", "job",
+                                       "submit", "-s", "slurm", job_path],
+                                      universal_newlines=True)
+        assert read_log(stub_dir)[-1] == "sbatch --parsable"
+        with open(os.path.join(stub_dir, out.strip() + ".sh")) as f:
+            assert "#SBATCH --job-name=single" in f.read()
+
+        # job scripts in a directory
+        job_dir = os.path.join(stub_dir, "jobs")
+        g = Graph(json.loads(js_str), backend="slurm")
+        subprocess.check_output(["bash", "-c", g.render_control_script(job_dir=job_dir)])
+        assert read_log(stub_dir)[-1].endswith(".sh")
+    finally:
+        shutil.rmtree(stub_dir)
+
+    # truncated ids in the qstat table, unknown Slurm states
+    qstat = """Job ID                    Name             User            Time Use S Queue
+------------------------- ---------------- --------------- -------- - -----
+1032924.admin-node.clu    align            user            00:01:00 R batch
+"""
+    states = get_backend("pbs").poll(["1032924.admin-node.cluster.example.org"],
+                                     run=lambda argv: qstat)
+    assert list(states.values()) == [RUNNING]
+    states = get_backend("slurm").poll(["7", "8", "9"], run=lambda argv: "7 CD\n8 XX\n")
+    assert states == {"7": DONE, "8": QUEUED, "9": DONE}
+
+    # accounting of finished jobs
+    qstat_f = """Job Id: 12.server
+    Job_Name = align
+    job_state = C
+    resources_used.cput = 00:09:58
+    resources_used.mem = 2097152kb
+    resources_used.walltime = 00:10:00
+    exit_status = 0
+
+Job Id: 13.server
+    Job_Name = sort
+    job_state = R
+    resources_used.walltime = 00:01:00
+
+Job Id: 14.server
+    Job_Name = index
+    job_state = C
+    resources_used.walltime = 01:00:01
+    exit_status = -11
+"""
+    usages = get_backend("pbs").parse_accounting(qstat_f)
+    assert usages == {"12.server": Usage(True, 600, 2 * 1024 ** 3),
+                      "14.server": Usage(False, 3601, None)}
+    usages = get_backend("pbspro").parse_accounting(qstat_f.replace("job_state = C", "job_state = F")
+                                                           .replace("exit_status", "Exit_status"))
+    assert sorted(usages) == ["12.server", "14.server"]
+
+    sacct = """101|COMPLETED|600|
+101.batch|COMPLETED|600|1048576K
+101.0|COMPLETED|590|2097152K
+102|CANCELLED by 1000|30|
+103|RUNNING|60|
+"""
+    usages = get_backend("slurm").parse_accounting(sacct)
+    assert usages == {"101": Usage(True, 600, 2 * 1024 ** 3),
+                      "102": Usage(False, 30, None)}
+    print(get_backend("slurm").accounting_argv(["101", "102"]))
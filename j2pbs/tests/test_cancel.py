@@ -0,0 +1,92 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import shutil
+import subprocess
+
+from j2pbs.model import Graph
+from j2pbs.tests.stubs import use_stubs, read_log
+from j2pbs.metrics import REGISTRY as metrics
+from j2pbs.exceptions import CommandError
+from j2pbs.records import read_record
+from j2pbs.cancel import cancel_graph
+
+
+if __name__ == "__main__":
+    # record submitted ids and cancel a sub tree
+    #
+    #   0 ---> 1 ---> 2
+    #   3 ---> 4
+    #
+    js_dict = {
+        "name": "cancel",
+        "jobs": [
+            {"id": 0, "name": "job0", "cmd": "sleep 10"},
+            {"id": 1, "name": "job1", "cmd": "sleep 10", "depend": 0},
+            {"id": 2, "name": "job2", "cmd": "sleep 10", "depend": 1},
+            {"id": 3, "name": "job3", "cmd": "sleep 10"},
+            {"id": 4, "name": "job4", "cmd": "sleep 10", "depend": 3}
+        ]
+    }
+    stub_dir = use_stubs()
+    try:
+        js_path = os.path.join(stub_dir, "cancel.json")
+        with open(js_path, 'w') as f:
+            json.dump(js_dict, f)
+        subprocess.check_call([sys.executable, "-m", "j2pbs", "submit", js_path],
+                              stdout=open(os.devnull, 'w'))
+        name2id = read_record(js_path + ".ids")
+        assert sorted(name2id) == ["job0", "job1", "job2", "job3", "job4"]
+
+        g = Graph(js_dict)
+        calls = []
+        def run(argv):
+            calls.append(argv)
+            return ""
+        cancelled, failed = cancel_graph(g, name2id, from_job="1", run=run)
+        assert cancelled == [name2id["job2"], name2id["job1"]] and failed == []
+        assert calls == [["qdel", name2id["job2"], name2id["job1"]]]
+
+        calls = []
+        cancelled, failed = cancel_graph(g, name2id, batch=2, parallel=2, run=run)
+        assert len(cancelled) == 5
+        assert sorted(len(c) for c in calls) == [2, 3, 3]
+
+        # failed batches are reported, not counted
+        metrics.clear()
+        def run(argv):
+            if name2id["job0"] in argv:
+                raise CommandError(argv, 1, "", "qdel: Unauthorized Request")
+            return ""
+        cancelled, failed = cancel_graph(g, name2id, batch=2, parallel=2, run=run)
+        assert len(cancelled) == 4
+        assert [ids for ids, error in failed] == [[name2id["job0"]]]
+        assert "Unauthorized Request" in failed[0][1]
+        assert metrics.get('j2pbs_cancelled_jobs_total', backend='pbs') == 4
+        assert metrics.get('j2pbs_cancel_failures_total', backend='pbs') == 1
+
+        out = subprocess.check_output([sys.executable, "-m", "j2pbs", "cancel", js_path, "--from", "job3"],
+                                      universal_newlines=True)
+        print(out)
+        assert out.strip() == "2 jobs cancelled."
+        assert "qdel {} {}".format(name2id["job4"], name2id["job3"]) in read_log(stub_dir)
+
+        # jobs already left the scheduler
+        out = subprocess.check_output([sys.executable, "-m", "j2pbs", "cancel", js_path, "--from", "job3"],
+                                      universal_newlines=True)
+        assert out.strip() == "2 jobs cancelled."
+
+        # the scheduler is unreachable
+        open(os.path.join(stub_dir, "down"), 'w').close()
+        p = subprocess.Popen([sys.executable, "-m", "j2pbs", "cancel", js_path],
+                             stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                             universal_newlines=True)
+        out, err = p.communicate()
+        print(err)
+        assert p.returncode == 1
+        assert out.strip() == "0 jobs cancelled."
+        assert "cannot connect to server" in err
+    finally:
+        shutil.rmtree(stub_dir)
@@ -1,9 +1,13 @@
 from __future__ import print_function
 
+import os
 import json
+import shutil
+import tempfile
 
 from j2pbs.model import Graph
 from j2pbs.exceptions import GraphLoopDependent, RepeatJobNameOrId
+from j2pbs.exceptions import VariableLoopReference, JobBuildError, ConfFileSyntaxError
 
 def get_graph(js_str):
     js_dict = json.loads(js_str)
@@ -186,3 +190,303 @@ if __name__ == "__main__":
     print(g5.control_script)
     print(file_spliter)
     print()
+
+    # test variables reference
+    js_str = """
+    {
+        "name": "test",
+        "shell": true,
+        "var":
+        {
+            "java": "java -Xmx4g",
+            "trimm": "$java -jar $tools/trimmomatic.jar",
+            "tools": "$HOME/tools"
+        },
+        "jobs":
+        [
+            {"id":0, "name":"test1", "cmd":"$trimm -threads 2"},
+            {"id":1, "name":"test2", "var": {"out": "$tools/out"}, "cmd":"ls $out", "depend": 0}
+        ]
+    }
+    """
+    g6 = get_graph(js_str)
+    home = os.environ['HOME']
+    assert g6.scope['trimm'] == "java -Xmx4g -jar {}/tools/trimmomatic.jar".format(home)
+    assert g6.jobs[0].commands == ["java -Xmx4g -jar {}/tools/trimmomatic.jar -threads 2".format(home)]
+    assert g6.jobs[1].commands == ["ls {}/tools/out".format(home)]
+
+    # loop in variables reference
+    js_str = """
+    {
+        "name": "test",
+        "var": {"a": "$b", "b": "x $a"},
+        "jobs": [ {"id":0, "name":"test1", "cmd":"echo $a"} ]
+    }
+    """
+    try:
+        g7 = get_graph(js_str)
+        assert False
+    except VariableLoopReference as e:
+        print(str(e))
+
+    # local variable extends the global one, quoting in values is kept
+    js_str = """
+    {
+        "name": "test",
+        "var": {"opts": "-t 4", "base": "/opt"},
+        "jobs": [
+            {"id": 0, "name": "test1", "var": {"opts": "$opts -v"}, "cmd": "bwa $opts"},
+            {"id": 1, "name": "test2",
+             "var": {"prog": "awk '{print $1}'  $base/x \\"$base/y z\\""},
+             "cmd": "echo"},
+            {"id": 2, "name": "test3", "var": {"pat": "grep ^chr ^$HOME $base/^x"}, "cmd": "echo"}
+        ]
+    }
+    """
+    g7 = get_graph(js_str)
+    assert g7.jobs[2].scope['pat'] == "grep ^chr $HOME /opt/^x"
+    assert g7.jobs[0].scope['opts'] == "-t 4 -v"
+    assert g7.jobs[0].commands == ["bwa -t 4 -v"]
+    assert g7.jobs[1].scope['prog'] == "awk '{print $1}'  /opt/x \"/opt/y z\""
+
+    # build jobs in parallel
+    js_dict = {
+        "name": "parallel",
+        "var": {"greet": "hello"},
+        "jobs": [{"id": i, "name": "job{}".format(i), "cmd": "echo $greet " + str(i),
+                  "depend": [i-1] if i else []} for i in range(50)]
+    }
+    g8 = Graph(js_dict, processes=2, chunksize=10)
+    serial = Graph(js_dict)
+    assert [j.record for j in g8.jobs] == [j.record for j in serial.jobs]
+    assert g8.control_script == serial.control_script
+
+    js_dict['jobs'][23]['cmd'] = "echo $nobody"
+    try:
+        Graph(js_dict, processes=2, chunksize=10)
+        assert False
+    except JobBuildError as e:
+        assert e.errors[0][0] == 23
+        print(str(e))
+
+    # job bodies are deduplicated
+    js_dict = {
+        "name": "sweep",
+        "jobs": [{"id": i, "name": "sweep{}".format(i), "cmd": "sleep 10"} for i in range(100)]
+    }
+    g9 = Graph(js_dict)
+    bodies, job2body = g9.job_bodies
+    assert len(bodies) == 1
+    scr = g9.control_script
+    assert scr.count("sleep 10") == 1
+    assert "cat" not in scr
+    assert "SWEEP99_ID=$(_j2pbs_body_0 -N sweep99)" in scr
+
+    # write job bodies to a directory
+    job_dir = tempfile.mkdtemp()
+    try:
+        scr = g1.render_control_script(job_dir=job_dir)
+        files = os.listdir(job_dir)
+        assert len(files) == 3 # sleep 10, sleep 20, echo ...
+        assert "_j2pbs_body_" not in scr
+        print(file_spliter)
+        print(scr)
+        print(file_spliter)
+    finally:
+        shutil.rmtree(job_dir)
+
+    # single job graph
+    g10 = get_graph("""{"name": "single", "jobs": [{"id":0, "name":"test0", "cmd":"sleep 10"}]}""")
+    print(g10.control_script)
+
+    # dependent types and redundant edges
+    #
+    #    0 ---> 1 ---> 2
+    #    |_____________^   (0->2 is redundant)
+    #    3 ---> 4 -any-> 5
+    #    |_____________^   (3->5 is kept, 4->5 is not 'afterok')
+    #
+    js_str = """
+    {
+        "name": "test",
+        "jobs":
+        [
+            {"id":0, "name":"test0", "cmd":"sleep 10"},
+            {"id":1, "name":"test1", "cmd":"sleep 10", "depend": 0},
+            {"id":2, "name":"test2", "cmd":"sleep 10", "depend": [0, 1, 1]},
+            {"id":3, "name":"test3", "cmd":"sleep 10"},
+            {"id":4, "name":"test4", "cmd":"sleep 10", "depend": 3},
+            {"id":5, "name":"test5", "cmd":"sleep 10", "depend": [3, {"id": 4, "type": "afterany"}]}
+        ]
+    }
+    """
+    g11 = get_graph(js_str)
+    names = lambda jobs: [j.name for j in jobs]
+    assert names(g11.dependent[g11.jobs[2]]) == ["test1"]
+    assert names(g11.dependent[g11.jobs[5]]) == ["test3", "test4"]
+    scr = g11.control_script
+    assert "depend=afterok:$TEST3_ID,afterany:$TEST4_ID" in scr
+    g12 = Graph(json.loads(js_str), reduce=False)
+    assert names(g12.dependent[g12.jobs[2]]) == ["test0", "test1", "test1"]
+    print(scr)
+
+    # chains merged into one job, only the chain ends are kept
+    jobs = []
+    for c in range(3):
+        for i in range(5):
+            jobs.append({"id": "c{}_{}".format(c, i), "name": "c{}_{}".format(c, i), "cmd": "ls",
+                         "depend": ["c{}_{}".format(c, i-1)] if i else []})
+    jobs.append({"id": "m", "name": "m", "cmd": "ls",
+                 "depend": ["c0_1", "c0_4", "c1_4", "c2_4", "c1_0"]})
+    g12 = Graph({"name": "merge", "jobs": jobs})
+    assert names(g12.dependent[g12.jobs[-1]]) == ["c0_4", "c1_4", "c2_4"]
+
+    for depend in ('{"id": 0, "type": "after"}', '[0, {"id": 0, "type": "afterany"}]'):
+        try:
+            get_graph("""{"name": "t", "jobs": [{"id":0, "name":"a", "cmd":"ls"},
+                {"id":1, "name":"b", "cmd":"ls", "depend": %s}]}""" % depend)
+            assert False
+        except ConfFileSyntaxError as e:
+            print(str(e))
+
+    # include other graphs
+    #
+    #   prepare ---> qc.0 ---> qc.1 --->|
+    #           |--> qc.2 ------------->|---> report
+    #
+    inc_dir = tempfile.mkdtemp()
+    try:
+        qc_dict = {
+            "name": "qc",
+            "var": {"fastqc": "/opt/fastqc"},
+            "jobs": [
+                {"id": 0, "name": "trim", "cmd": "echo trim"},
+                {"id": 1, "name": "fastqc", "cmd": "$fastqc x.fq", "depend": 0},
+                {"id": 2, "name": "stat", "cmd": "echo stat"}
+            ]
+        }
+        with open(os.path.join(inc_dir, "qc.json"), 'w') as f:
+            json.dump(qc_dict, f)
+        main_dict = {
+            "name": "main",
+            "include": [{"path": "qc.json", "depend": "prepare"},
+                        {"path": "qc.json", "as": "qc2"}],
+            "jobs": [
+                {"id": "prepare", "name": "prepare", "cmd": "echo prepare"},
+                {"id": "report", "name": "report", "cmd": "echo report", "depend": "qc"}
+            ]
+        }
+        main_path = os.path.join(inc_dir, "main.json")
+        with open(main_path, 'w') as f:
+            json.dump(main_dict, f)
+        g13 = Graph.from_file(main_path)
+        id2job = {j.id: j for j in g13.jobs}
+        assert len(g13.jobs) == 8
+        assert id2job["qc.1"].name == "qc_fastqc"
+        assert id2job["qc.1"].commands == ["/opt/fastqc x.fq"]
+        assert [j.id for j in g13.dependent[id2job["qc.0"]]] == ["prepare"]
+        assert [j.id for j in g13.dependent[id2job["qc.1"]]] == ["qc.0"]
+        assert [j.id for j in g13.dependent[id2job["qc2.0"]]] == []
+        assert [j.id for j in g13.dependent[id2job["report"]]] == ["qc.1", "qc.2"]
+        assert g13.sources == [os.path.join(inc_dir, "qc.json")] * 2
+        print(g13.control_script)
+
+        # dependent type of the include
+        main_dict["include"][1]["depend"] = {"id": "prepare", "type": "afterany"}
+        g13 = Graph(main_dict, base_dir=inc_dir)
+        id2job = {j.id: j for j in g13.jobs}
+        assert g13.depend_type(id2job["qc2.0"], id2job["prepare"]) == "afterany"
+        assert g13.depend_type(id2job["qc2.1"], id2job["qc2.0"]) == "afterok"
+        assert "-W depend=afterany:$PREPARE_ID" in g13.control_script
+
+        # only the including graph is recorded in metrics
+        from j2pbs.metrics import REGISTRY as metrics
+        metrics.clear()
+        os.utime(os.path.join(inc_dir, "qc.json"), (1, 1)) # parse the included file again
+        g13 = Graph.from_file(main_path)
+        assert metrics.get('j2pbs_graph_jobs').count == 1
+        assert metrics.get('j2pbs_graph_jobs').sum == 8
+        assert metrics.get('j2pbs_graph_build_seconds').count == 1
+
+        # included graph is parsed once
+        from j2pbs import model
+        cached = model.load_included_graph(os.path.join(inc_dir, "qc.json"))
+        assert model.load_included_graph(os.path.join(inc_dir, "qc.json")) is cached
+
+        # nested include, reloaded when the innermost file changes
+        def write(name, js_dict):
+            with open(os.path.join(inc_dir, name), 'w') as f:
+                json.dump(js_dict, f)
+        write("c.json", {"name": "c", "jobs": [{"id": 0, "name": "c", "cmd": "echo c1"}]})
+        write("b.json", {"name": "b", "include": "c.json",
+                         "jobs": [{"id": 0, "name": "b", "cmd": "echo b"}]})
+        write("a.json", {"name": "a", "include": "b.json",
+                         "jobs": [{"id": 0, "name": "a", "cmd": "echo a"}]})
+        a_path = os.path.join(inc_dir, "a.json")
+        assert "echo c1" in Graph.from_file(a_path).control_script
+        write("c.json", {"name": "c", "jobs": [{"id": 0, "name": "c", "cmd": "echo c2"}]})
+        os.utime(os.path.join(inc_dir, "c.json"), (1, 1))
+        assert "echo c2" in Graph.from_file(a_path).control_script
+
+        # include loop
+        with open(os.path.join(inc_dir, "qc.json"), 'w') as f:
+            qc_dict["include"] = "main.json"
+            json.dump(qc_dict, f)
+        os.utime(os.path.join(inc_dir, "qc.json"), (0, 0))
+        try:
+            Graph.from_file(main_path)
+            assert False
+        except ConfFileSyntaxError as e:
+            print(str(e))
+    finally:
+        shutil.rmtree(inc_dir)
+
+    print(file_spliter)
+    # resources profiles and auto-sizing
+    size_dir = tempfile.mkdtemp()
+    try:
+        small_path = os.path.join(size_dir, "small.fq")
+        with open(small_path, 'w') as f:
+            f.write("@r\nACGT\n+\nIIII\n")
+        g14 = Graph({
+            "name": "sizing",
+            "resources": {"walltime": "01:00:00"},
+            "profiles": {"small": {"ppn": 1, "mem": "2gb"},
+                         "bigmem": {"ppn": 8, "mem": "64gb"}},
+            "autosize": {"var": "input",
+                         "rules": [{"max": "1gb", "profile": "small"},
+                                   {"max": "20gb", "resources": {"mem": "16gb"}},
+                                   {"profile": "bigmem"}]},
+            "jobs": [
+                {"id": 0, "name": "file", "var": {"input": small_path}, "cmd": "cat $input"},
+                {"id": 1, "name": "medium", "var": {"input": "10gb"}, "cmd": "echo"},
+                {"id": 2, "name": "large", "var": {"input": "100gb"}, "cmd": "echo",
+                 "resources": {"walltime": "10:00:00"}},
+                {"id": 3, "name": "profile", "profile": "bigmem", "var": {"input": "1kb"}, "cmd": "echo"},
+                {"id": 4, "name": "plain", "cmd": "echo"},
+                {"id": 5, "name": "upstream", "var": {"input": "/data/not_made_yet.bam"},
+                 "cmd": "echo"}
+            ]
+        })
+        res = [j.resources for j in g14.jobs]
+        assert res[0] == {'nodes': 1, 'ppn': 1, 'mem': '2gb', 'walltime': '01:00:00'}
+        assert res[1] == {'nodes': 1, 'ppn': 1, 'mem': '16gb', 'walltime': '01:00:00'}
+        assert res[2] == {'nodes': 1, 'ppn': 8, 'mem': '64gb', 'walltime': '10:00:00'}
+        assert res[3] == {'nodes': 1, 'ppn': 8, 'mem': '64gb', 'walltime': '01:00:00'}
+        assert res[4] == {'nodes': 1, 'ppn': 1, 'walltime': '01:00:00'}
+        assert res[5] == res[4] # size unknown, no rule matched
+        print(g14.control_script)
+
+        try:
+            get_graph('{"jobs": [{"id": 0, "name": "x", "cmd": "echo", "profile": "huge"}]}')
+            assert False
+        except ConfFileSyntaxError as e:
+            print(str(e))
+        try:
+            Graph({"autosize": {"var": "input", "rules": [{"max": "big", "resources": {}}]},
+                   "jobs": [{"id": 0, "name": "x", "cmd": "echo", "var": {"input": "/no/file"}}]})
+            assert False
+        except ConfFileSyntaxError as e:
+            print(str(e))
+    finally:
+        shutil.rmtree(size_dir)
@@ -0,0 +1,69 @@
+from __future__ import print_function
+
+import os
+import json
+import shutil
+import subprocess
+
+from j2pbs.model import Graph
+from j2pbs.history import History, apply_history, percentile, command_fingerprint
+from j2pbs.records import read_record
+from j2pbs.tests.stubs import use_stubs
+
+if __name__ == "__main__":
+    assert percentile([1, 2, 3, 4], 50) == 2
+    assert percentile([1, 2, 3, 4], 95) == 4
+    assert percentile([5], 95) == 5
+
+    js_str = """
+    {
+        "name": "history",
+        "resources": {"walltime": "10:00:00"},
+        "jobs":
+        [
+            {"id": 0, "name": "align", "cmd": "bwa mem ref.fa r1.fq"},
+            {"id": 1, "name": "sort", "cmd": "samtools sort a.bam", "depend": 0}
+        ]
+    }
+    """
+    stub_dir = use_stubs()
+    try:
+        record = os.path.join(stub_dir, "history.ids")
+        history = History(os.path.join(stub_dir, "db", "history.sqlite"))
+        for name in ("pbs", "slurm"):
+            # submit the graph 3 times, align runs 10, 20 and 30 minutes
+            for minutes in (10, 20, 30):
+                g = Graph(json.loads(js_str), backend=name)
+                subprocess.check_output(["bash", "-c", g.render_control_script(record=record)])
+                name2id = read_record(record)
+                with open(os.path.join(stub_dir, "accounting"), 'w') as f:
+                    f.write("{} 0 {} {}\n".format(name2id["align"], minutes * 60, minutes * 1024 ** 2))
+                    f.write("{} 1 60 1024\n".format(name2id["sort"])) # failed
+                assert history.collect(g, name2id) == 2
+                assert history.collect(g, name2id) == 0 # recorded once
+
+        align, sort = g.jobs
+        assert sorted(history.samples("align", command_fingerprint(align), 'runtime')) == \
+                [600, 600, 1200, 1200, 1800, 1800]
+        assert history.estimate(sort) == {} # failed runs are not used
+        estimates = history.estimate(align)
+        assert estimates == {'walltime': '00:36:00', 'mem': '36864mb'}
+
+        # edited commands have no history
+        edited = json.loads(js_str)
+        edited["jobs"][0]["cmd"] = "bwa mem -t 8 ref.fa r1.fq"
+        assert history.estimate(Graph(edited).jobs[0]) == {}
+
+        # fill in mem, tighten walltime only if asked
+        g = Graph(json.loads(js_str))
+        assert apply_history(g, history) == 1
+        assert g.jobs[0].resources['mem'] == '36864mb'
+        assert g.jobs[0].resources['walltime'] == '10:00:00'
+        assert apply_history(g, history, tighten=True) == 1
+        assert g.jobs[0].resources['walltime'] == '00:36:00'
+        assert g.jobs[1].resources == {'nodes': 1, 'ppn': 1, 'walltime': '10:00:00'}
+        assert "#PBS -l walltime=00:36:00" in g.jobs[0].pbs_script
+        print(g.control_script)
+        history.close()
+    finally:
+        shutil.rmtree(stub_dir)
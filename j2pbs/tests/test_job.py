@@ -3,7 +3,7 @@ from __future__ import print_function
 import json
 
 from j2pbs.model import Job
-from j2pbs.exceptions import ConfFileSyntaxError, VariableKeyError
+from j2pbs.exceptions import ConfFileSyntaxError, VariableKeyError, InvalidResources
 
 def print_job(job):
     print(
@@ -146,3 +146,18 @@ if __name__ == "__main__":
     assert job.resources['ppn'] == 2
     print_job(job)
     print()
+
+    # resources are merged with the defaults key by key
+    job = Job({"id": 8, "name": "mem", "cmd": "echo", "resources": {"mem": "8gb"}},
+              default_resources=default_resources)
+    assert job.resources == {'nodes': 1, 'ppn': 2, 'mem': '8gb'}
+    print_job(job)
+    print()
+
+    # invalid resources
+    for resources in ({"ppn": 0}, {"ppn": "two"}, {"mem": "lots"}, {"walltime": "1:xx"}):
+        try:
+            Job({"id": 9, "name": "bad", "cmd": "echo", "resources": resources})
+            assert False
+        except InvalidResources as e:
+            print(str(e))
@@ -0,0 +1,99 @@
+from __future__ import print_function
+
+import json
+
+from j2pbs.model import Graph
+from j2pbs.simulate import simulate, parse_walltime, array_tasks
+from j2pbs.exceptions import InvalidResources
+
+if __name__ == "__main__":
+    assert parse_walltime("10") == 10
+    assert parse_walltime("01:00") == 60
+    assert parse_walltime("02:00:00") == 7200
+    assert parse_walltime("1:00:00:00") == 86400
+    try:
+        parse_walltime("1h")
+        assert False
+    except InvalidResources as e:
+        print(str(e))
+
+    #    0(1h, 2 cores) ---> 2(2h)
+    #    1(1h, 2 cores) ---> 3(1h) ---> 4(1h)
+    js_str = """
+    {
+        "name": "simulate",
+        "resources": {"nodes": 1, "ppn": 1, "walltime": "01:00:00"},
+        "jobs":
+        [
+            {"id":0, "name":"job0", "cmd":"sleep 10", "resources": {"nodes": 1, "ppn": 2}},
+            {"id":1, "name":"job1", "cmd":"sleep 10", "resources": {"nodes": 1, "ppn": 2}},
+            {"id":2, "name":"job2", "cmd":"sleep 10", "depend": 0,
+             "resources": {"nodes": 1, "ppn": 1, "walltime": "02:00:00"}},
+            {"id":3, "name":"job3", "cmd":"sleep 10", "depend": 1},
+            {"id":4, "name":"job4", "cmd":"sleep 10", "depend": 3}
+        ]
+    }
+    """
+    g = Graph(json.loads(js_str))
+    res = simulate(g, cores=4)
+    print(res.report())
+    assert res.makespan == 3 * 3600
+    assert res.critical_path_length == 3 * 3600
+    assert res.peak_running == 2
+    assert res.peak_running_cores == 4
+    assert res.core_hours == 8
+
+    # only 2 cores, job0 and job1 run one by one
+    res = simulate(g, cores=2)
+    assert res.makespan == 4 * 3600
+    assert res.peak_waiting == 1
+
+    try:
+        simulate(g, cores=1)
+        assert False
+    except InvalidResources as e:
+        print(str(e))
+
+    # array jobs run one task per index
+    assert array_tasks(None) == (1, None)
+    assert array_tasks("1-10") == (10, None)
+    assert array_tasks("1,3,5-9:2") == (5, None)
+    assert array_tasks("1-100%10") == (100, 10)
+    for array in ("a-b", "10-1", "1-10%0"):
+        try:
+            array_tasks(array)
+            assert False
+        except InvalidResources as e:
+            print(str(e))
+
+    #    array(4 tasks, 1h) ---> report(1h)
+    js_dict = {
+        "name": "array",
+        "resources": {"nodes": 1, "ppn": 1, "walltime": "01:00:00"},
+        "jobs": [
+            {"id": 0, "name": "array", "cmd": "sleep 10", "array": "1-4"},
+            {"id": 1, "name": "report", "cmd": "sleep 10", "depend": 0}
+        ]
+    }
+    res = simulate(Graph(js_dict), cores=2)
+    assert res.makespan == 3 * 3600
+    assert res.core_hours == 5
+    assert res.peak_running == 2 and res.peak_running_cores == 2
+    js_dict["jobs"][0]["array"] = "1-4%1"
+    res = simulate(Graph(js_dict), cores=4)
+    print(res.report())
+    assert res.makespan == 5 * 3600
+    assert res.critical_path_length == 5 * 3600
+    assert res.peak_running == 1
+
+    # big graph
+    n = 20000
+    js_dict = {
+        "name": "big",
+        "resources": {"nodes": 1, "ppn": 1, "walltime": "00:10:00"},
+        "jobs": [{"id": i, "name": "job{}".format(i), "cmd": "sleep 10",
+                  "depend": [i // 2] if i else []} for i in range(n)]
+    }
+    res = simulate(Graph(js_dict), cores=1000, order='critical')
+    print(res.report())
+    assert res.peak_running == 1000
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import print_function
+
+import os
+import json
+import tempfile
+
+from j2pbs.model import Graph
+from j2pbs import snapshot
+from j2pbs.exceptions import SnapshotFormatError
+
+if __name__ == "__main__":
+    js_str = """
+    {
+        "name": "snapshot test",
+        "var": {"greet": "hello"},
+        "resources": {"nodes": 1, "ppn": 2, "walltime": "01:00:00"},
+        "jobs":
+        [
+            {"id":0, "name":"test0", "cmd":"sleep 10"},
+            {"id":"a", "name":"test1", "cmd":["echo $greet", "echo 中文"]},
+            {"id":2, "name":"test2", "cmd":"sleep 20", "depend":[0, {"id": "a", "type": "afterany"}]}
+        ]
+    }
+    """
+    g = Graph(json.loads(js_str))
+    fd, path = tempfile.mkstemp(suffix=".j2g")
+    os.close(fd)
+    try:
+        snapshot.dump(g, path)
+        snap = snapshot.load(path)
+        assert len(snap) == 3
+        assert snap.name == "snapshot test"
+        assert snap.job_id(1) == "a"
+        assert snap.job_name(2) == "test2"
+        assert snap.job_commands(1) == ["echo hello", "echo 中文"]
+        assert snap.job_dependent(2) == [0, 1]
+        assert snap.job_depend_types(2) == ["afterok", "afterany"]
+
+        g2 = snap.to_graph()
+        assert [j.record for j in g2.jobs] == [j.record for j in g.jobs]
+        assert g2.control_script == g.control_script
+        print(g2.control_script)
+        assert snap.to_graph(backend="slurm").backend.name == "slurm"
+        assert snapshot.is_snapshot(path)
+        snap.close()
+
+        # empty file
+        open(path, 'wb').close()
+        try:
+            snapshot.load(path)
+            assert False
+        except SnapshotFormatError as e:
+            print(str(e))
+
+        # broken file
+        with open(path, 'wb') as f:
+            f.write(b"XXXX" + snapshot.dumps(g)[4:])
+        try:
+            snapshot.load(path)
+            assert False
+        except SnapshotFormatError as e:
+            print(str(e))
+    finally:
+        os.remove(path)
@@ -0,0 +1,189 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import shutil
+import subprocess
+
+from j2pbs.model import Graph
+from j2pbs.submitter import Submitter
+from j2pbs.tests.stubs import use_stubs, read_log
+from j2pbs.metrics import REGISTRY as metrics
+from j2pbs.exceptions import SubmitError
+
+
+def finish_all(stub_dir):
+    """ Simulate all queued jobs finished. """
+    open(os.path.join(stub_dir, "queue"), 'w').close()
+
+
+if __name__ == "__main__":
+    # chain of 3 jobs and 4 independent jobs
+    js_dict = {
+        "name": "throttle",
+        "jobs": [{"id": i, "name": "job{}".format(i), "cmd": "sleep 10",
+                  "depend": [i-1] if 0 < i < 3 else []} for i in range(7)]
+    }
+    stub_dir = use_stubs()
+    try:
+        g = Graph(js_dict)
+        sleeps = []
+        def sleep(seconds):
+            sleeps.append(seconds)
+            finish_all(stub_dir)
+
+        s = Submitter(g, max_inflight=3, poll_interval=5, sleep=sleep)
+        ids = s.submit_all()
+        assert len(ids) == 7
+        assert sleeps == [5, 5]
+        log = read_log(stub_dir)
+        print("\n".join(log))
+        submits = [l for l in log if l.startswith("qsub")]
+        assert len(submits) == 7
+        # never more than 3 jobs submitted between two polls
+        n = 0
+        for line in log:
+            if line.startswith("qsub"):
+                n += 1
+                assert n <= 3
+            elif line.startswith("qstat"):
+                n = 0
+        # dependences on in-flight jobs are kept
+        assert submits[1] == "qsub -W depend=afterok:{}".format(ids[g.jobs[0]])
+        # topological order
+        order = [ids[j] for j in g.jobs]
+        assert order == sorted(order, key=lambda id_: int(id_.split(".")[0]))
+
+        # no limit
+        s = Submitter(g, sleep=sleep)
+        s.submit_all()
+        assert len(s.inflight) == 7
+
+        # the status command fails, the window is kept
+        down = os.path.join(stub_dir, "down")
+        open(down, 'w').close()
+        finish_all(stub_dir)
+        s.refresh()
+        assert len(s.inflight) == 7 and not s.finished
+        assert metrics.get('j2pbs_poll_failures_total', backend='pbs') == 1
+        os.remove(down)
+        s.refresh()
+        assert not s.inflight and len(s.finished) == 7
+    finally:
+        shutil.rmtree(stub_dir)
+
+    # retries and metrics
+    metrics.clear()
+    outputs = ["", "", "10.admin", "", "", ""]
+    def run(argv, input=None):
+        return outputs.pop(0)
+    s = Submitter(Graph(js_dict), run=run, sleep=lambda s: None, retries=2)
+    try:
+        s.submit_all()
+        assert False
+    except SubmitError as e:
+        print(str(e))
+    labels = {'backend': 'pbs'}
+    assert metrics.get('j2pbs_submitted_jobs_total', **labels) == 1
+    assert metrics.get('j2pbs_submit_retries_total', **labels) == 4
+    assert metrics.get('j2pbs_submit_failures_total', **labels) == 1
+    assert metrics.get('j2pbs_submit_seconds', **labels).count == 6
+    assert metrics.get('j2pbs_graph_jobs').count == 1
+    prom = metrics.to_prometheus()
+    assert 'j2pbs_submit_retries_total{backend="pbs"} 4' in prom
+    assert 'j2pbs_submit_seconds_count{backend="pbs"} 6' in prom
+    lines = [json.loads(l) for l in metrics.to_jsonl().splitlines()]
+    assert {l['name'] for l in lines} >= {'j2pbs_submit_seconds', 'j2pbs_graph_build_seconds'}
+    print(prom)
+
+    # --metrics alone runs the control script, --direct submits from python
+    stub_dir = use_stubs()
+    try:
+        js_path = os.path.join(stub_dir, "throttle.json")
+        with open(js_path, 'w') as f:
+            json.dump(js_dict, f)
+        metrics_path = os.path.join(stub_dir, "metrics.jsonl")
+        for direct in ([], ["--direct"]):
+            subprocess.check_call([sys.executable, "-m", "j2pbs", "--metrics", metrics_path,
+                                   "submit"] + direct + [js_path],
+                                  stdout=open(os.devnull, 'w'))
+            with open(metrics_path) as f:
+                names = {json.loads(l)['name'] for l in f}
+            assert ('j2pbs_submit_seconds' in names) == bool(direct)
+        submits = [l for l in read_log(stub_dir) if l.startswith("qsub")]
+        assert submits[0] == "qsub -N job0" and submits[7] == "qsub"
+    finally:
+        shutil.rmtree(stub_dir)
+
+    # dependences on jobs which left the queue, checked with their exit states
+    #
+    #   a(fails) -afterok-> c -afterok-> f
+    #            -afterany-> d
+    #            -afternotok-> e
+    #   b(ok)    -afternotok-> g
+    #
+    js_dict = {
+        "name": "failure",
+        "jobs": [
+            {"id": "a", "name": "a", "cmd": "exit 1"},
+            {"id": "b", "name": "b", "cmd": "true"},
+            {"id": "c", "name": "c", "cmd": "true", "depend": "a"},
+            {"id": "d", "name": "d", "cmd": "true", "depend": {"id": "a", "type": "afterany"}},
+            {"id": "e", "name": "e", "cmd": "true", "depend": {"id": "a", "type": "afternotok"}},
+            {"id": "f", "name": "f", "cmd": "true", "depend": "c"},
+            {"id": "g", "name": "g", "cmd": "true", "depend": {"id": "b", "type": "afternotok"}}
+        ]
+    }
+    stub_dir = use_stubs()
+    try:
+        g = Graph(js_dict)
+        def sleep(seconds):
+            with open(os.path.join(stub_dir, "accounting"), 'w') as f:
+                for job, id_ in s.ids.items():
+                    f.write("{} {} 10 1024\n".format(id_, 1 if job.name == "a" else 0))
+            finish_all(stub_dir)
+        s = Submitter(g, max_inflight=2, poll_interval=5, sleep=sleep)
+        ids = s.submit_all()
+        assert sorted(j.name for j in ids) == ["a", "b", "d", "e"]
+        assert sorted(j.name for j in s.skipped) == ["c", "f", "g"]
+        submits = [l for l in read_log(stub_dir) if l.startswith("qsub")]
+        assert submits == ["qsub"] * 4 # satisfied dependences are dropped
+        assert metrics.get('j2pbs_skipped_jobs_total', backend='pbs') == 3
+
+        # exit state unknown, the dependence is kept for the scheduler
+        g = Graph(js_dict)
+        s = Submitter(g, max_inflight=2, poll_interval=5, sleep=lambda sec: finish_all(stub_dir))
+        os.remove(os.path.join(stub_dir, "accounting"))
+        ids = s.submit_all()
+        assert len(ids) == 7
+        submits = [l for l in read_log(stub_dir) if l.startswith("qsub")][4:]
+        assert submits[2] == "qsub -W depend=afterok:{}".format(ids[g.jobs[0]])
+
+        # an in-flight job whose dependence fails never runs, it frees the window
+        js_dict = {
+            "name": "never",
+            "jobs": [
+                {"id": "a", "name": "a", "cmd": "exit 1"},
+                {"id": "c", "name": "c", "cmd": "true", "depend": "a"},
+                {"id": "b", "name": "b", "cmd": "true"}
+            ]
+        }
+        g = Graph(js_dict, backend="slurm")
+        sleeps = []
+        def sleep(seconds):
+            sleeps.append(seconds)
+            assert len(sleeps) < 3
+            id_a = s.ids[g.jobs[0]]
+            with open(os.path.join(stub_dir, "accounting"), 'w') as f:
+                f.write("{} 1 10 1024\n".format(id_a))
+            with open(os.path.join(stub_dir, "queue")) as f:
+                queue = [l for l in f if l.split()[0] != id_a]
+            with open(os.path.join(stub_dir, "queue"), 'w') as f:
+                f.writelines(queue) # c is left pending
+        s = Submitter(g, max_inflight=2, poll_interval=5, sleep=sleep)
+        ids = s.submit_all()
+        assert len(ids) == 3 and len(sleeps) == 1
+        assert s.finished == {g.jobs[0]: False, g.jobs[1]: False}
+    finally:
+        shutil.rmtree(stub_dir)
@@ -0,0 +1,142 @@
+from __future__ import print_function
+
+import os
+import json
+import shutil
+import tempfile
+
+from j2pbs.model import Graph
+from j2pbs.watch import Watcher
+from j2pbs.metrics import REGISTRY as metrics
+
+def write_json(path, js_dict, mtime):
+    with open(path, 'w') as f:
+        json.dump(js_dict, f)
+    os.utime(path, (mtime, mtime)) # mtime resolution of some file systems is 1s
+
+if __name__ == "__main__":
+    js_dict = {
+        "name": "watch",
+        "var": {"ref": "hg38.fa"},
+        "jobs": [
+            {"id": 0, "name": "align", "cmd": "bwa mem $ref r1.fq"},
+            {"id": 1, "name": "sort", "cmd": "samtools sort a.bam", "depend": 0},
+            {"id": 2, "name": "index", "cmd": "samtools index a.bam", "depend": 1}
+        ]
+    }
+
+    # job cache, only edited jobs are built again
+    cache = {}
+    g = Graph(js_dict, job_cache=cache)
+    assert len(cache) == 3
+    metrics.clear()
+    js_dict["jobs"][2]["cmd"] = "samtools index -c a.bam"
+    g = Graph(js_dict, job_cache=cache)
+    assert metrics.get('j2pbs_job_cache_hits_total') == 2
+    assert len(cache) == 3 # entry of the old job is dropped
+    assert g.jobs[2].commands == ["samtools index -c a.bam"]
+    assert [j.name for j in g.dependent[g.jobs[2]]] == ["sort"]
+
+    # global variables changed, all jobs are built again
+    metrics.clear()
+    js_dict["var"]["ref"] = "hg19.fa"
+    g = Graph(js_dict, job_cache=cache)
+    assert metrics.get('j2pbs_job_cache_hits_total') == 0
+    assert g.jobs[0].commands == ["bwa mem hg19.fa r1.fq"]
+    print(g.control_script)
+
+    # auto-sized jobs are not cached, their input files may grow
+    size_dir = tempfile.mkdtemp()
+    try:
+        input_path = os.path.join(size_dir, "r1.fq")
+        with open(input_path, 'w') as f:
+            f.write("@r\nACGT\n+\nIIII\n")
+        sized_dict = {
+            "name": "sizing",
+            "autosize": {"var": "input",
+                         "rules": [{"max": "1kb", "resources": {"mem": "1gb"}},
+                                   {"resources": {"mem": "8gb"}}]},
+            "jobs": [
+                {"id": 0, "name": "align", "var": {"input": input_path}, "cmd": "bwa mem $input"},
+                {"id": 1, "name": "report", "profile": "none", "cmd": "echo done", "depend": 0}
+            ],
+            "profiles": {"none": {}}
+        }
+        cache = {}
+        g = Graph(sized_dict, job_cache=cache)
+        assert g.jobs[0].resources["mem"] == "1gb"
+        assert len(cache) == 1
+        with open(input_path, 'a') as f:
+            f.write("A" * 2048)
+        metrics.clear()
+        g = Graph(sized_dict, job_cache=cache)
+        assert g.jobs[0].resources["mem"] == "8gb"
+        assert metrics.get('j2pbs_job_cache_hits_total') == 1
+        assert [j.name for j in g.dependent[g.jobs[1]]] == ["align"]
+    finally:
+        shutil.rmtree(size_dir)
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        json_path = os.path.join(work_dir, "watch.json")
+        target = os.path.join(work_dir, "watch.sh")
+        job_dir = os.path.join(work_dir, "jobs")
+        log = open(os.devnull, 'w')
+        write_json(json_path, js_dict, 1000)
+        w = Watcher(json_path, target, job_dir=job_dir, out=log, sleep=lambda s: None)
+
+        assert w.poll()
+        assert not w.poll() # nothing changed
+        with open(target) as f:
+            script = f.read()
+        print(script)
+        files = sorted(os.listdir(job_dir))
+        assert len(files) == 3
+        # script of another graph sharing the job dir
+        other = os.path.join(job_dir, "0123456789abcdef.sh")
+        open(other, 'w').close()
+
+        # unchanged job scripts are kept, the stale one is removed
+        js_dict["jobs"][1]["cmd"] = "samtools sort -@ 4 a.bam"
+        write_json(json_path, js_dict, 2000)
+        assert w.poll()
+        new_files = sorted(f for f in os.listdir(job_dir) if f != "0123456789abcdef.sh")
+        assert len(new_files) == 3
+        assert len(set(files) & set(new_files)) == 2
+        assert os.path.exists(other)
+
+        # touched without changes, the control script is not rewritten
+        os.utime(json_path, (3000, 3000))
+        mtime = os.path.getmtime(target)
+        assert not w.poll()
+        assert os.path.getmtime(target) == mtime
+
+        # errors are reported, the last good script is kept
+        with open(json_path, 'w') as f:
+            f.write("{ broken")
+        os.utime(json_path, (4000, 4000))
+        assert not w.poll()
+        assert os.path.exists(target)
+        assert not w.poll() # not retried until modified again
+
+        write_json(json_path, js_dict, 5000)
+        w.run(max_polls=2)
+        assert not w.changed()
+
+        # broken included file is not retried until modified again
+        inc_path = os.path.join(work_dir, "inc.json")
+        with open(inc_path, 'w') as f:
+            f.write("{ broken")
+        os.utime(inc_path, (6000, 6000))
+        js_dict["include"] = {"path": "inc.json", "as": "inc"}
+        write_json(json_path, js_dict, 6000)
+        assert not w.poll()
+        assert not w.changed()
+        write_json(inc_path, {"name": "inc", "jobs": [{"id": 0, "name": "qc", "cmd": "echo"}]}, 7000)
+        assert w.changed()
+        assert w.poll()
+        with open(target) as f:
+            assert "inc_qc" in f.read()
+        log.close()
+    finally:
+        shutil.rmtree(work_dir)
@@ -0,0 +1,172 @@
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+
+from .model import Graph
+from .json_utils import upper_dict_key, extract_includes
+from .history import apply_history
+from .exceptions import ConfFileSyntaxError, GraphLoopDependent
+from .metrics import REGISTRY as metrics
+
+"""
+watch
+~~~~~
+Convert a json config file again whenever it or the files it includes changed.
+
+Files are polled by their modify time. Jobs are cached by the digest of their
+json and the graph defaults, so only the edited jobs are built again,
+unchanged job scripts in the job directory are not rewritten,
+scripts written by this watcher and not used any more are removed,
+and the control script is written only when it's content changed.
+
+>>> w = Watcher("pipeline.json", "pipeline.sh", job_dir="jobs")
+>>> w.run()  # until interrupted
+
+"""
+
+
+def included_paths(json_path):
+    """
+    Paths of the files included by a json config file, recursively,
+    stop at the files can't be parsed (they are still returned).
+    """
+    paths = []
+    stack = [os.path.abspath(json_path)]
+    while stack:
+        path = stack.pop()
+        try:
+            with open(path) as f:
+                includes = extract_includes(upper_dict_key(json.load(f)))
+        except (ConfFileSyntaxError, ValueError, AttributeError, IOError, OSError):
+            continue
+        base_dir = os.path.dirname(path)
+        for include in includes:
+            sub = os.path.abspath(os.path.join(base_dir, include[0]))
+            if sub not in paths:
+                paths.append(sub)
+                stack.append(sub)
+    return paths
+
+
+class Watcher(object):
+    """
+    Watch a json config file, convert it to the control script on changes.
+
+    :json_path: the config json file.
+    :target: path of the control script.
+    :job_dir: write job scripts to this directory, see `Graph.render_control_script`. [None]
+    :record: let the control script record submitted job ids to this file. [None]
+    :interval: seconds between two polls. [1]
+    :processes: build jobs in parallel with this number of processes. [None]
+    :backend: scheduler backend, override the config file. [None]
+    :history: set resources of jobs from this `j2pbs.history.History`. [None]
+    :tighten: lower requested resources to the history estimates. [False]
+    :sleep: function for sleep, replaceable for tests.
+    :out: file to report conversions and errors. [stderr]
+
+    """
+
+    def __init__(self, json_path, target,
+                 job_dir=None,
+                 record=None,
+                 interval=1.0,
+                 processes=None,
+                 backend=None,
+                 history=None,
+                 tighten=False,
+                 sleep=time.sleep,
+                 out=sys.stderr):
+        self.json_path = os.path.abspath(json_path)
+        self.target = target
+        self.job_dir = job_dir
+        self.record = record
+        self.interval = interval
+        self.processes = processes
+        self.backend = backend
+        self.history = history
+        self.tighten = tighten
+        self.sleep = sleep
+        self.out = out
+
+        self.job_cache = {}  # job digest -> job record
+        self.mtimes = {}     # watched path -> modify time at the last conversion
+        self.script = None   # the last written control script
+        self.job_files = set() # scripts written to job_dir by this watcher
+
+    @staticmethod
+    def mtime(path):
+        try:
+            return os.path.getmtime(path)
+        except OSError: # removed, or being replaced by an editor
+            return None
+
+    def changed(self):
+        """ Whether any watched file changed since the last conversion. """
+        if not self.mtimes:
+            return True
+        return any(self.mtime(path) != t for path, t in self.mtimes.items())
+
+    def convert(self):
+        """
+        Convert the config file, rewrite the control script if it changed.
+        return True if the control script is rewritten.
+        """
+        start_time = time.time()
+        mtimes = {self.json_path: self.mtime(self.json_path)} # before reading, not miss edits
+        with open(self.json_path) as f:
+            js_dict = json.load(f)
+        graph = Graph(js_dict,
+                processes=self.processes,
+                backend=self.backend,
+                base_dir=os.path.dirname(self.json_path),
+                job_cache=self.job_cache)
+        for path in graph.sources:
+            mtimes[path] = self.mtime(path)
+        self.mtimes = mtimes
+        if self.history is not None:
+            apply_history(graph, self.history, tighten=self.tighten)
+        script = graph.render_control_script(job_dir=self.job_dir, record=self.record,
+                                             owned_files=self.job_files)
+        rewritten = script != self.script
+        if rewritten:
+            tmp = "{}.{}.tmp".format(self.target, os.getpid())
+            with open(tmp, 'w') as f:
+                f.write(script)
+            os.rename(tmp, self.target) # readers never see a partial script
+            self.script = script
+        metrics.observe('j2pbs_watch_convert_seconds', time.time() - start_time)
+        return rewritten
+
+    def poll(self):
+        """
+        Convert if any watched file changed, errors in the config are reported
+        and the last good control script is kept.
+        return True if the control script is rewritten.
+        """
+        if not self.changed():
+            return False
+        try:
+            rewritten = self.convert()
+        except (ConfFileSyntaxError, GraphLoopDependent,
+                ValueError, KeyError, IOError, OSError) as e: # json and config errors
+            # convert again only after any of the files is modified
+            paths = set(self.mtimes) | set(included_paths(self.json_path))
+            paths.add(self.json_path)
+            self.mtimes = {path: self.mtime(path) for path in paths}
+            print("j2pbs: {}: {}".format(type(e).__name__, e), file=self.out)
+            return False
+        if rewritten:
+            print("j2pbs: {} converted.".format(self.target), file=self.out)
+        return rewritten
+
+    def run(self, max_polls=None):
+        """ Poll until interrupted, or `max_polls` times. """
+        n = 0
+        while max_polls is None or n < max_polls:
+            self.poll()
+            n += 1
+            if max_polls is None or n < max_polls:
+                self.sleep(self.interval)
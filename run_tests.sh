@@ -2,3 +2,10 @@
 
 python -m j2pbs.tests.test_job > /dev/null
 python -m j2pbs.tests.test_graph > /dev/null
+python -m j2pbs.tests.test_snapshot > /dev/null
+python -m j2pbs.tests.test_backends > /dev/null
+python -m j2pbs.tests.test_submitter > /dev/null
+python -m j2pbs.tests.test_cancel > /dev/null
+python -m j2pbs.tests.test_simulate > /dev/null
+python -m j2pbs.tests.test_watch > /dev/null
+python -m j2pbs.tests.test_history > /dev/null